@@ -1,8 +1,208 @@
 from prefect import flow, task, get_run_logger
 from prefect_aws import AwsCredentials
 from pathlib import Path
+from functools import lru_cache
+import re
+import threading
+import time
 import clickhouse_connect
 
+# Directory that sql_script_path is relative to
+_BASE_DIR = Path(__file__).parent
+
+# Resolved MinIO credentials are reused for this long before the block is
+# reloaded from the Prefect API, so key rotations still propagate.
+_CREDS_TTL_SECONDS = 15 * 60
+
+# block name -> (loaded_at, (access_key_id, secret_access_key, endpoint_url))
+_creds_cache: dict[str, tuple[float, tuple[str, str, str]]] = {}
+
+# script path -> (mtime, template text)
+_sql_template_cache: dict[Path, tuple[float, str]] = {}
+
+# Shared ClickHouse client, kept open across flow runs in the same process
+_client_lock = threading.Lock()
+_client = None
+_client_key = None
+
+# Top-level "SET name = value" statements in the export script. These are
+# turned into client settings instead of being sent as separate requests.
+_SET_RE = re.compile(r"SET\s+(\w+)\s*=\s*(.+)", re.IGNORECASE | re.DOTALL)
+
+# Server-side query parameters in the export script, e.g. {s3_bucket:String}
+_PARAM_RE = re.compile(r"\{(\w+):[^{}]+\}")
+
+# Tokens of the export script, matched in a single pass. Quoted literals and
+# identifiers come first so '--' or ';' inside them is never treated as syntax.
+_TOKEN_RE = re.compile(r"""
+      (?P<quoted> '(?:[^'\\]|\\.|'')*' | "(?:[^"\\]|\\.|"")*" | `(?:[^`\\]|\\.|``)*` )
+    | (?P<line_comment> --[^\n]* )
+    | (?P<block_comment> /\*.*?(?:\*/|\Z) )
+    | (?P<semicolon> ; )
+    | (?P<text> [^'"`;/-]+ | . )
+""", re.VERBOSE | re.DOTALL)
+
+_BANNER = "=" * 60
+
+
+def _split_statements(sql_script: str) -> list[str]:
+    """
+    Split a SQL script into statements on top-level semicolons.
+
+    Comments are dropped; quoted strings and identifiers are copied verbatim,
+    so a '--' or ';' inside a literal does not break the statement.
+    """
+    statements = []
+    current = []
+
+    for token in _TOKEN_RE.finditer(sql_script):
+        kind = token.lastgroup
+        if kind in ('line_comment', 'block_comment'):
+            continue
+        elif kind == 'semicolon':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(token.group())
+
+    # Handle any remaining statement without semicolon
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+
+    return statements
+
+
+def _load_minio_creds(block_name: str) -> tuple[str, str, str]:
+    """
+    Load (access_key_id, secret_access_key, endpoint_url) from an AwsCredentials block.
+
+    Results are cached per block for _CREDS_TTL_SECONDS.
+    """
+    cached = _creds_cache.get(block_name)
+    if cached and time.monotonic() - cached[0] < _CREDS_TTL_SECONDS:
+        return cached[1]
+
+    minio_creds = AwsCredentials.load(block_name)
+
+    # Get endpoint URL
+    endpoint_url = getattr(minio_creds.aws_client_parameters, "endpoint_url", None)
+
+    # Extract credentials
+    access_key_id = minio_creds.aws_access_key_id
+    secret_access_key = minio_creds.aws_secret_access_key
+
+    # Handle SecretStr objects
+    if hasattr(access_key_id, 'get_secret_value'):
+        access_key_id = access_key_id.get_secret_value()
+    if hasattr(secret_access_key, 'get_secret_value'):
+        secret_access_key = secret_access_key.get_secret_value()
+
+    creds = (access_key_id, secret_access_key, endpoint_url)
+    _creds_cache[block_name] = (time.monotonic(), creds)
+    return creds
+
+
+def _get_client(**client_args):
+    """
+    Return the shared ClickHouse client, creating it on first use.
+
+    The client is recreated when the connection arguments change or when it
+    no longer answers a ping.
+    """
+    global _client, _client_key
+
+    key = repr(sorted(client_args.items()))
+    with _client_lock:
+        if _client is not None and (_client_key != key or not _client.ping()):
+            _client.close()
+            _client = None
+        if _client is None:
+            _client = clickhouse_connect.get_client(**client_args)
+            _client_key = key
+        return _client
+
+
+def _read_sql_template(script_path: Path) -> str:
+    """
+    Read the SQL template, reusing the cached text while the file mtime is unchanged.
+    """
+    mtime = script_path.stat().st_mtime
+    cached = _sql_template_cache.get(script_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    sql_template = script_path.read_text()
+    _sql_template_cache[script_path] = (mtime, sql_template)
+    return sql_template
+
+
+def _extract_settings(statements: list[str]) -> tuple[dict, list[str]]:
+    """
+    Separate SET statements from the rest of the script.
+
+    Returns (settings, statements) where settings can be passed to the client
+    so they apply to every query without a round-trip of their own.
+    """
+    settings = {}
+    remaining = []
+    for statement in statements:
+        match = _SET_RE.fullmatch(statement)
+        if match:
+            settings[match.group(1)] = match.group(2).strip().strip("'")
+        else:
+            remaining.append(statement)
+    return settings, remaining
+
+
+@lru_cache(maxsize=8)
+def _parse_script(sql_script: str) -> tuple[dict, tuple[str, ...]]:
+    """
+    Split the script and extract its SET statements, cached on the script text.
+    """
+    settings, statements = _extract_settings(_split_statements(sql_script))
+    return settings, tuple(statements)
+
+
+def _execute_statement(client, i: int, total: int, statement: str, parameters: dict, logger) -> str:
+    """
+    Execute a single statement and return a short result summary.
+
+    Only the parameters referenced by the statement are sent; values are bound
+    server-side, so secrets never appear in the statement text.
+    """
+    logger.info("\nExecuting statement %d/%d", i, total)
+    logger.info("Preview: %s...", statement[:150])
+
+    try:
+        used = {name: parameters[name] for name in _PARAM_RE.findall(statement) if name in parameters}
+        result = client.command(statement, parameters=used or None)
+
+        # Extract useful info from QuerySummary if available
+        result_info = ""
+        if result and hasattr(result, 'written_rows'):
+            # This is a QuerySummary object
+            parts = []
+            if result.written_rows > 0:
+                parts.append(f"written={result.written_rows:,} rows")
+            if hasattr(result, 'result_rows') and result.result_rows > 0:
+                parts.append(f"result={result.result_rows:,} rows")
+            if hasattr(result, 'elapsed') and result.elapsed > 0:
+                parts.append(f"time={result.elapsed:.2f}s")
+
+            result_info = ", ".join(parts) if parts else "ok"
+            logger.info("✓ Statement %d: %s", i, result_info)
+        else:
+            logger.info("✓ Statement %d completed", i)
+
+        return result_info or "completed"
+    except Exception as e:
+        logger.error("✗ Statement %d failed: %s", i, e)
+        logger.error("Full statement:\n%s", statement)
+        raise
+
 
 @task(name="Execute IPFIX Export Script", retries=2)
 def execute_ipfix_export_script(
@@ -14,7 +214,8 @@ def execute_ipfix_export_script(
     minio_credentials_block: str,
     minio_bucket: str,
     sql_script_path: str = "scripts/ipfix-export.sql",
-    dry_run: bool = True
+    dry_run: bool = True,
+    verbose: bool = False
 ) -> dict:
     """
     Execute the IPFIX export SQL script against ClickHouse.
@@ -23,6 +224,8 @@ def execute_ipfix_export_script(
     In normal mode, the script marks rows for export, exports to S3/MinIO, and deletes exported rows.
 
     Note: Uses the ClickHouse HTTP interface (port 8123), not the native protocol (port 9000).
+    clickhouse_connect only speaks HTTP; each client keeps its connection alive,
+    so statements within a run do not pay a new TCP/TLS handshake.
 
     Args:
         clickhouse_host: ClickHouse server hostname
@@ -34,193 +237,128 @@ def execute_ipfix_export_script(
         minio_bucket: MinIO bucket name
         sql_script_path: Path to SQL script file
         dry_run: If True, only count rows without exporting or deleting (default: True)
+        verbose: If True, include per-statement results in the returned dictionary
 
     Returns:
         Dictionary with execution statistics
     """
     logger = get_run_logger()
 
-    logger.info(f"DRY RUN MODE: {'ENABLED - will only count rows' if dry_run else 'DISABLED - will export and delete'}")
+    logger.info("DRY RUN MODE: %s", 'ENABLED - will only count rows' if dry_run else 'DISABLED - will export and delete')
 
     # Load MinIO credentials to get template variables
-    logger.info(f"Loading MinIO credentials from block: {minio_credentials_block}")
-    minio_creds = AwsCredentials.load(minio_credentials_block)
-
-    # Get endpoint URL
-    endpoint_url = None
-    if minio_creds.aws_client_parameters:
-        client_params = minio_creds.aws_client_parameters.model_dump()
-        endpoint_url = client_params.get("endpoint_url")
-
-    # Extract credentials
-    access_key_id = minio_creds.aws_access_key_id
-    secret_access_key = minio_creds.aws_secret_access_key
-
-    # Handle SecretStr objects
-    if hasattr(access_key_id, 'get_secret_value'):
-        access_key_id = access_key_id.get_secret_value()
-    if hasattr(secret_access_key, 'get_secret_value'):
-        secret_access_key = secret_access_key.get_secret_value()
+    logger.info("Loading MinIO credentials from block: %s", minio_credentials_block)
+    access_key_id, secret_access_key, endpoint_url = _load_minio_creds(minio_credentials_block)
 
     # Strip protocol from endpoint for S3 URL
     s3_endpoint = endpoint_url.replace('https://', '').replace('http://', '')
 
-    logger.info(f"S3 endpoint: {s3_endpoint}")
-    logger.info(f"S3 bucket: {minio_bucket}")
+    logger.info("S3 endpoint: %s", s3_endpoint)
+    logger.info("S3 bucket: %s", minio_bucket)
 
     # Read SQL script
-    script_path = Path(__file__).parent / sql_script_path
-    logger.info(f"Reading SQL script from {script_path}")
-
-    with open(script_path, 'r') as f:
-        sql_template = f.read()
-
-    # Replace template variables
-    sql_script = sql_template.replace('{{ s3_endpoint }}', s3_endpoint)
-    sql_script = sql_script.replace('{{ s3_bucket }}', minio_bucket)
-    sql_script = sql_script.replace('{{ s3_access_key }}', access_key_id)
-    sql_script = sql_script.replace('{{ s3_secret_key }}', secret_access_key)
-
-    logger.info(f"Template variables substituted")
+    script_path = _BASE_DIR / sql_script_path
+    logger.info("Reading SQL script from %s", script_path)
+
+    # Query parameters referenced as {name:Type} in the script
+    parameters = {
+        's3_endpoint': s3_endpoint,
+        's3_bucket': minio_bucket,
+        's3_access_key': access_key_id,
+        's3_secret_key': secret_access_key,
+    }
+
+    # Split script into individual statements. The HTTP interface accepts a
+    # single statement per request, so SET statements are applied as session
+    # settings on the client rather than as requests of their own.
+    session_settings, statements = _parse_script(_read_sql_template(script_path))
+    if session_settings:
+        logger.info("Session settings from script: %s", session_settings)
 
     # Connect to ClickHouse
-    logger.info(f"Connecting to ClickHouse at {clickhouse_host}:{clickhouse_port}")
-    client = clickhouse_connect.get_client(
+    logger.info("Connecting to ClickHouse at %s:%s", clickhouse_host, clickhouse_port)
+    client_args = dict(
         host=clickhouse_host,
         port=clickhouse_port,
         username=clickhouse_user,
         password=clickhouse_password,
-        database=clickhouse_database
+        database=clickhouse_database,
+        settings=dict(session_settings),
+        compress='lz4',  # compress request/response bodies on the wire
+        query_limit=0    # no client-side row cap on query results
     )
+    client = _get_client(**client_args)
 
-    try:
-        # Dry run mode: just count rows
-        if dry_run:
-            logger.info("=" * 60)
-            logger.info("DRY RUN MODE - Counting rows only")
-            logger.info("=" * 60)
-
-            # Count unexported rows
-            count_query = "SELECT count(*) as cnt FROM playground.ipfix_raw_data WHERE exported = 0"
-            result = client.query(count_query)
-            unexported_count = result.result_rows[0][0] if result.result_rows else 0
-
-            logger.info(f"Unexported rows (exported = 0): {unexported_count:,}")
-
-            # Count already exported rows
-            exported_query = "SELECT count(*) as cnt FROM playground.ipfix_raw_data WHERE exported = 1"
-            result = client.query(exported_query)
-            exported_count = result.result_rows[0][0] if result.result_rows else 0
-
-            logger.info(f"Exported rows (exported = 1): {exported_count:,}")
-
-            # Total count
-            total_query = "SELECT count(*) as cnt FROM playground.ipfix_raw_data"
-            result = client.query(total_query)
-            total_count = result.result_rows[0][0] if result.result_rows else 0
-
-            logger.info(f"Total rows: {total_count:,}")
-
-            logger.info("=" * 60)
-            logger.info("DRY RUN COMPLETE - No data was exported or deleted")
-            logger.info("Set dry_run=False to actually export and delete")
-            logger.info("=" * 60)
-
-            return {
-                "dry_run": True,
-                "unexported_rows": unexported_count,
-                "exported_rows": exported_count,
-                "total_rows": total_count,
-                "statements_executed": 0
-            }
-
-        # Normal mode: execute the full script
-        logger.info("=" * 60)
-        logger.info("NORMAL MODE - Executing export script")
-        logger.info("=" * 60)
-
-        # Split script into individual statements
-        # Handle inline comments and multi-line statements properly
-        statements = []
-        current_statement = []
-
-        for line in sql_script.split('\n'):
-            # Strip inline comments (anything after -- on the same line)
-            if '--' in line:
-                # Split on first occurrence of --
-                line_parts = line.split('--', 1)
-                line = line_parts[0]
-
-            # Skip empty lines or pure comment lines
-            if not line.strip():
-                continue
-
-            current_statement.append(line)
-
-            # Check if line ends with semicolon (end of statement)
-            if line.rstrip().endswith(';'):
-                statement = '\n'.join(current_statement).strip()
-                if statement:
-                    statements.append(statement)
-                current_statement = []
-
-        # Handle any remaining statement without semicolon
-        if current_statement:
-            statement = '\n'.join(current_statement).strip()
-            if statement:
-                statements.append(statement)
-
-        # Execute each statement
-        logger.info(f"Parsed {len(statements)} SQL statements from script")
-        results = []
-
-        for i, statement in enumerate(statements, 1):
-            logger.info(f"\nExecuting statement {i}/{len(statements)}")
-            logger.info(f"Preview: {statement[:150]}...")
-
-            try:
-                result = client.command(statement)
-
-                # Extract useful info from QuerySummary if available
-                result_info = ""
-                if result and hasattr(result, 'written_rows'):
-                    # This is a QuerySummary object
-                    parts = []
-                    if result.written_rows > 0:
-                        parts.append(f"written={result.written_rows:,} rows")
-                    if hasattr(result, 'result_rows') and result.result_rows > 0:
-                        parts.append(f"result={result.result_rows:,} rows")
-                    if hasattr(result, 'elapsed') and result.elapsed > 0:
-                        parts.append(f"time={result.elapsed:.2f}s")
-
-                    result_info = ", ".join(parts) if parts else "ok"
-                    logger.info(f"✓ Statement {i}: {result_info}")
-                else:
-                    logger.info(f"✓ Statement {i} completed")
-
-                results.append({
-                    "statement_number": i,
-                    "preview": statement[:100],
-                    "result": result_info or "completed",
-                    "status": "success"
-                })
-            except Exception as e:
-                logger.error(f"✗ Statement {i} failed: {str(e)}")
-                logger.error(f"Full statement:\n{statement}")
-                raise
-
-        logger.info(f"\n{'='*60}")
-        logger.info(f"All {len(statements)} statements executed successfully")
-        logger.info(f"{'='*60}")
+    # Dry run mode: just count rows
+    if dry_run:
+        logger.info(_BANNER)
+        logger.info("DRY RUN MODE - Counting rows only")
+        logger.info(_BANNER)
+
+        # Count unexported, exported and total rows in a single scan. count()
+        # rides on the same pass over the exported column, so reading the
+        # total from system.parts would not save a scan, and system tables
+        # are rejected by the query cache used below.
+        count_query = """
+            SELECT
+                countIf(exported = 0) AS unexported,
+                countIf(exported = 1) AS exported,
+                count() AS total
+            FROM playground.ipfix_raw_data
+        """
+        # Serve repeated dry runs from the query cache. The TTL is kept short
+        # because the unexported count changes with every insert.
+        result = client.query(count_query, settings={'use_query_cache': 1, 'query_cache_ttl': 10})
+        unexported_count, exported_count, total_count = result.result_rows[0] if result.result_rows else (0, 0, 0)
+
+        logger.info("Unexported rows (exported = 0): %s", format(unexported_count, ","))
+        logger.info("Exported rows (exported = 1): %s", format(exported_count, ","))
+        logger.info("Total rows: %s", format(total_count, ","))
+
+        logger.info(_BANNER)
+        logger.info("DRY RUN COMPLETE - No data was exported or deleted")
+        logger.info("Set dry_run=False to actually export and delete")
+        logger.info(_BANNER)
 
         return {
-            "dry_run": False,
-            "statements_executed": len(statements),
-            "results": results
+            "dry_run": True,
+            "unexported_rows": unexported_count,
+            "exported_rows": exported_count,
+            "total_rows": total_count,
+            "statements_executed": 0
         }
 
-    finally:
-        client.close()
+    # Normal mode: execute the full script
+    logger.info(_BANNER)
+    logger.info("NORMAL MODE - Executing export script")
+    logger.info(_BANNER)
+
+    # Execute each statement in script order; each step depends on the previous
+    # one (mark -> export -> delete), so they are never run concurrently
+    logger.info("Parsed %d SQL statements from script", len(statements))
+    results = []
+
+    for i, statement in enumerate(statements, 1):
+        result_info = _execute_statement(client, i, len(statements), statement, parameters, logger)
+        if verbose:
+            results.append({
+                "statement_number": i,
+                "preview": statement[:100],
+                "result": result_info,
+                "status": "success"
+            })
+
+    logger.info("\n%s", _BANNER)
+    logger.info("All %d statements executed successfully", len(statements))
+    logger.info(_BANNER)
+
+    summary = {
+        "dry_run": False,
+        "statements_executed": len(statements)
+    }
+    if verbose:
+        summary["results"] = results
+    return summary
 
 
 @flow(name="ClickHouse IPFIX Export", log_prints=True)
@@ -233,7 +371,8 @@ def clickhouse_export_pipeline(
     minio_credentials_block: str = "minio-ipfix-credentials",
     minio_bucket: str = "ipfix",
     sql_script_path: str = "scripts/ipfix-export.sql",
-    dry_run: bool = True
+    dry_run: bool = True,
+    verbose: bool = False
 ):
     """
     Export IPFIX data from ClickHouse to MinIO using the ipfix-export.sql script.
@@ -256,6 +395,7 @@ def clickhouse_export_pipeline(
         minio_bucket: MinIO bucket name (default: ipfix)
         sql_script_path: Path to SQL script file (default: scripts/ipfix-export.sql)
         dry_run: If True, only count rows without exporting or deleting (default: True)
+        verbose: If True, collect and print per-statement results (default: False)
     """
 
     print("Starting ClickHouse IPFIX Export Pipeline...")
@@ -279,7 +419,8 @@ def clickhouse_export_pipeline(
         minio_credentials_block=minio_credentials_block,
         minio_bucket=minio_bucket,
         sql_script_path=sql_script_path,
-        dry_run=dry_run
+        dry_run=dry_run,
+        verbose=verbose
     )
 
     # Print results based on mode
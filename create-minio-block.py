@@ -66,10 +66,7 @@ try:
             test_credentials = AwsCredentials.load(block_name)
 
             # Get endpoint from client parameters
-            endpoint_url = None
-            if test_credentials.aws_client_parameters:
-                client_params = test_credentials.aws_client_parameters.model_dump()
-                endpoint_url = client_params.get("endpoint_url")
+            endpoint_url = getattr(test_credentials.aws_client_parameters, "endpoint_url", None)
 
             boto3_session = test_credentials.get_boto3_session()
             s3_client = boto3_session.client('s3', endpoint_url=endpoint_url)
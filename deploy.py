@@ -15,17 +15,21 @@ Usage:
     python deploy.py --flow clickhouse        # Deploy specific flow
     python deploy.py --all                    # Deploy all flows (including dev)
     python deploy.py --dry-run                # Show what would be deployed
+    python deploy.py --force-build            # Rebuild image even if already pushed
 """
 
 import argparse
 import os
 import subprocess
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Callable, Optional
 from datetime import timedelta
 
 
+@lru_cache(maxsize=1)
 def get_git_commit_hash() -> str:
-    """Get current git commit hash (short form)."""
+    """Get current git commit hash (short form). Resolved once per process."""
     try:
         result = subprocess.run(
             ["git", "rev-parse", "--short", "HEAD"],
@@ -38,12 +42,41 @@ def get_git_commit_hash() -> str:
         return "latest"
 
 
+def is_working_tree_clean() -> bool:
+    """Check whether the git working tree has no uncommitted changes."""
+    try:
+        result = subprocess.run(
+            ["git", "status", "--porcelain"],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        return not result.stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+
+@lru_cache(maxsize=None)
 def get_docker_image_name(commit_hash: str) -> str:
     """Generate Docker image name with commit hash tag."""
     return f"cr.noroutine.me/sandbox/ipfix-pipeline-worker:{commit_hash}"
 
 
-def deploy_clickhouse_export_production(dry_run: bool = False) -> Optional[str]:
+def image_exists(image_name: str) -> bool:
+    """Check whether the image tag is already present in the registry."""
+    try:
+        result = subprocess.run(
+            ["docker", "buildx", "imagetools", "inspect", image_name],
+            capture_output=True,
+            text=True
+        )
+        return result.returncode == 0
+    except FileNotFoundError:
+        return False
+
+
+def deploy_clickhouse_export_production(dry_run: bool = False,
+                                        log: Callable[[str], None] = print) -> Optional[str]:
     """
     Deploy ClickHouse IPFIX export pipeline to production.
 
@@ -55,6 +88,7 @@ def deploy_clickhouse_export_production(dry_run: bool = False) -> Optional[str]:
 
     Args:
         dry_run: If True, only show what would be deployed
+        log: Called with each progress line (default: print)
 
     Returns:
         Deployment ID if successful, None if dry_run
@@ -64,14 +98,14 @@ def deploy_clickhouse_export_production(dry_run: bool = False) -> Optional[str]:
     commit_hash = get_git_commit_hash()
     image_name = get_docker_image_name(commit_hash)
 
-    print(f"Deploying ClickHouse Export to production")
-    print(f"  Commit: {commit_hash}")
-    print(f"  Image: {image_name}")
-    print(f"  Schedule: Every 5 minutes")
-    print(f"  Dry run: disabled (LIVE mode)")
+    log(f"Deploying ClickHouse Export to production")
+    log(f"  Commit: {commit_hash}")
+    log(f"  Image: {image_name}")
+    log(f"  Schedule: Every 5 minutes")
+    log(f"  Dry run: disabled (LIVE mode)")
 
     if dry_run:
-        print("  [DRY RUN] Would deploy but skipping...")
+        log("  [DRY RUN] Would deploy but skipping...")
         return None
 
     # Prefect 3.x API: use flow.deploy() instead of Deployment.build_from_flow()
@@ -100,11 +134,12 @@ def deploy_clickhouse_export_production(dry_run: bool = False) -> Optional[str]:
         enforce_parameter_schema=True
     )
 
-    print(f"✓ Deployed: {deployment_id}")
+    log(f"✓ Deployed: {deployment_id}")
     return str(deployment_id)
 
 
-def deploy_ipfix_analytics_production(dry_run: bool = False) -> Optional[str]:
+def deploy_ipfix_analytics_production(dry_run: bool = False,
+                                      log: Callable[[str], None] = print) -> Optional[str]:
     """
     Deploy IPFIX Analytics pipeline to production.
 
@@ -116,6 +151,7 @@ def deploy_ipfix_analytics_production(dry_run: bool = False) -> Optional[str]:
 
     Args:
         dry_run: If True, only show what would be deployed
+        log: Called with each progress line (default: print)
 
     Returns:
         Deployment ID if successful, None if dry_run
@@ -125,14 +161,14 @@ def deploy_ipfix_analytics_production(dry_run: bool = False) -> Optional[str]:
     commit_hash = get_git_commit_hash()
     image_name = get_docker_image_name(commit_hash)
 
-    print(f"Deploying IPFIX Analytics to production")
-    print(f"  Commit: {commit_hash}")
-    print(f"  Image: {image_name}")
-    print(f"  Schedule: Every hour")
-    print(f"  Retention: 5 days")
+    log(f"Deploying IPFIX Analytics to production")
+    log(f"  Commit: {commit_hash}")
+    log(f"  Image: {image_name}")
+    log(f"  Schedule: Every hour")
+    log(f"  Retention: 5 days")
 
     if dry_run:
-        print("  [DRY RUN] Would deploy but skipping...")
+        log("  [DRY RUN] Would deploy but skipping...")
         return None
 
     # Prefect 3.x API: use flow.deploy() instead of Deployment.build_from_flow()
@@ -155,19 +191,23 @@ def deploy_ipfix_analytics_production(dry_run: bool = False) -> Optional[str]:
         enforce_parameter_schema=True
     )
 
-    print(f"✓ Deployed: {deployment_id}")
+    log(f"✓ Deployed: {deployment_id}")
     return str(deployment_id)
 
 
-def build_docker_image(dry_run: bool = False) -> str:
+def build_docker_image(dry_run: bool = False, force: bool = False) -> str:
     """
     Build and push Docker image for deployments using the build script.
 
     Uses scripts/build-ipfix-pipeline-image.sh which builds multi-arch images
     (linux/amd64, linux/arm64) and pushes to the registry.
 
+    The build is skipped when an image for the current commit is already in
+    the registry and the working tree is clean, unless force is set.
+
     Args:
         dry_run: If True, only show what would be built
+        force: If True, rebuild even if the image tag already exists
 
     Returns:
         Image name with tag
@@ -180,6 +220,15 @@ def build_docker_image(dry_run: bool = False) -> str:
     print(f"  Script: scripts/build-ipfix-pipeline-image.sh")
     print(f"  Platforms: linux/amd64, linux/arm64")
 
+    # "latest" is the fallback tag when git is unavailable, and uncommitted
+    # changes are not part of the commit hash, so in either case the tag says
+    # nothing about whether the image matches the working tree
+    if not is_working_tree_clean():
+        print("  Working tree has uncommitted changes, image will be rebuilt")
+    elif not force and commit_hash != "latest" and image_exists(image_name):
+        print("  ✓ Image already present in registry, skipping build")
+        return image_name
+
     if dry_run:
         print("  [DRY RUN] Would build and push but skipping...")
         return image_name
@@ -242,6 +291,12 @@ def main():
         help="Skip Docker image build (assume image already exists)"
     )
 
+    parser.add_argument(
+        "--force-build",
+        action="store_true",
+        help="Rebuild Docker image even if the tag already exists in the registry"
+    )
+
     parser.add_argument(
         "--build-only",
         action="store_true",
@@ -257,7 +312,7 @@ def main():
     # Build Docker image first (unless skipped)
     if not args.skip_build:
         try:
-            image_name = build_docker_image(dry_run=args.dry_run)
+            image_name = build_docker_image(dry_run=args.dry_run, force=args.force_build)
 
             if args.build_only:
                 print("\n" + "="*60)
@@ -286,16 +341,31 @@ def main():
     deployed = []
     failed = []
 
-    for flow_name in flows_to_deploy:
-        deploy_func = DEPLOYMENTS[flow_name]
-
+    def deploy_buffered(flow_name: str) -> tuple[list, bool]:
+        # Collect progress lines so each flow's output is printed as one block
+        output = []
         try:
-            deployment_id = deploy_func(dry_run=args.dry_run)
-            if deployment_id or args.dry_run:
-                deployed.append(flow_name)
+            deployment_id = DEPLOYMENTS[flow_name](dry_run=args.dry_run, log=output.append)
+            return output, bool(deployment_id or args.dry_run)
         except Exception as e:
-            print(f"✗ Failed to deploy {flow_name}: {e}")
-            failed.append(flow_name)
+            output.append(f"✗ Failed to deploy {flow_name}: {e}")
+            return output, False
+
+    # Deployments are independent API calls, so run them concurrently
+    with ThreadPoolExecutor(max_workers=len(flows_to_deploy)) as executor:
+        futures = {
+            executor.submit(deploy_buffered, flow_name): flow_name
+            for flow_name in flows_to_deploy
+        }
+
+        for future in as_completed(futures):
+            flow_name = futures[future]
+            output, ok = future.result()
+            print("\n".join(output) + "\n")
+            if ok:
+                deployed.append(flow_name)
+            else:
+                failed.append(flow_name)
 
     # Summary
     print("\n" + "="*60)
@@ -1,4 +1,7 @@
 from prefect import flow, task, get_run_logger
+from prefect.task_runners import ThreadPoolTaskRunner
+import asyncio
+import logging
 import subprocess
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
@@ -6,6 +9,373 @@ from prefect_aws import AwsCredentials
 import os
 import shutil
 import duckdb
+import hashlib
+import mimetypes
+import json
+import re
+import shlex
+import time
+import mmap
+import threading
+import atexit
+from functools import lru_cache
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from dbt.cli.main import dbtRunner, dbtRunnerResult
+
+# Project layout, resolved once at import
+_BASE_DIR = Path(__file__).resolve().parent
+_EVIDENCE_DIR = _BASE_DIR / "evidence"
+_DBT_DIR = _BASE_DIR / "dbt"
+_BUILD_DIR = _EVIDENCE_DIR / "build"
+# dbt's profiles.yml reads the path from DBT_DUCKDB_PATH; it is set here, once,
+# so the in-process dbt run neither depends on the cwd nor changes the
+# environment while other tasks copy it for their subprocesses
+_DUCKDB_PATH = Path(os.environ.setdefault(
+    "DBT_DUCKDB_PATH", str(_EVIDENCE_DIR / "sources" / "ipfix" / "ipfix.duckdb")
+))
+
+# Maximum number of keys per S3 delete_objects request
+_DELETE_BATCH_SIZE = 1000
+
+# delete_objects requests kept in flight while the listing continues
+_DELETE_WORKERS = 8
+
+# Concurrent checks in validate_environment
+_VALIDATION_WORKERS = 6
+
+# How long a loaded credentials block is reused before it is loaded again
+_CREDS_TTL_SECONDS = 15 * 60
+
+# block name -> (loaded_at, credentials block)
+_creds_cache: dict[str, tuple[float, AwsCredentials]] = {}
+
+# block name -> ((endpoint url, access key id, secret access key), S3 client)
+_s3_client_cache: dict[str, tuple[tuple[str, str, str], object]] = {}
+
+# Guards both caches; tasks and validation checks run on worker threads
+_cache_lock = threading.Lock()
+
+# In-memory DuckDB connection with httpfs loaded, shared by tasks via cursors
+_duckdb_conn: duckdb.DuckDBPyConnection | None = None
+
+# Threads hashing build files for the deploy diff
+_HASH_WORKERS = 8
+
+# Parallel uploads and multipart threshold for the boto3 deploy engine
+_UPLOAD_WORKERS = 32
+_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+# Manifest from the last successful dbt build, used as --state for changed-only runs
+STATE_DIR = _BASE_DIR / ".dbt_state"
+
+# Digest of the last deployed content, used to skip no-op Evidence rebuilds and deploys
+PIPELINE_CACHE_DIR = _BASE_DIR / ".pipeline_cache"
+LAST_DIGEST_FILE = PIPELINE_CACHE_DIR / "last_digest"
+# relpath -> [size, mtime_ns, md5] of the last Evidence build deployed to each bucket
+BUILD_INDEX_FILE_TEMPLATE = "build_index.{bucket}.json"
+# Hash of the inputs of the last successful Evidence build
+BUILD_INPUTS_HASH_FILE = PIPELINE_CACHE_DIR / "evidence_build_hash"
+# "bucket/prefix" -> LastModified of the oldest object left by the last cleanup
+CLEANUP_WATERMARK_FILE = PIPELINE_CACHE_DIR / "last_cleanup.json"
+
+# Heap limit for the Evidence CLI; source refreshes hold whole query results in memory
+_NODE_MAX_OLD_SPACE_MB = 8192
+
+# Read size for warming the DuckDB file where MAP_POPULATE is unavailable
+_PREWARM_CHUNK_SIZE = 1024 * 1024
+
+# Subprocess output is read in chunks of this size and split into lines in bulk
+_READ_CHUNK_SIZE = 64 * 1024
+
+# Streamed output is sent to the logger in batches of up to this many lines,
+# or whatever has accumulated after this many seconds
+_LOG_BATCH_LINES = 64
+_LOG_BATCH_SECONDS = 0.2
+
+# Lines of output kept for error reports; everything is still logged as it arrives
+_OUTPUT_TAIL_LINES = 2000
+
+async def _stream_subprocess(cmd: list, cwd: Path, logger, env: dict = None,
+                             handle_line=None) -> tuple[int, deque]:
+    """
+    Run a command and stream its combined stdout/stderr to the logger as it arrives,
+    one log record per batch of lines rather than per line.
+
+    Args:
+        cmd: Command and arguments
+        cwd: Working directory for the command
+        logger: Logger to send output lines to
+        env: Environment for the command (default: inherit)
+        handle_line: Called with each output line instead of logging it (default: log every line)
+
+    Returns:
+        Tuple of (return code, last _OUTPUT_TAIL_LINES output lines)
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        env=env
+    )
+
+    output_lines = deque(maxlen=_OUTPUT_TAIL_LINES)
+    log_batch = []
+    last_flush = time.monotonic()
+
+    def flush():
+        nonlocal last_flush
+        if log_batch:
+            logger.info("\n".join(log_batch))
+            log_batch.clear()
+        last_flush = time.monotonic()
+
+    def emit(text: str):
+        for line in text.split("\n"):
+            line = line.rstrip()
+            if handle_line:
+                handle_line(line)
+            else:
+                log_batch.append(line)
+                if len(log_batch) >= _LOG_BATCH_LINES:
+                    flush()
+            output_lines.append(line)
+        if time.monotonic() - last_flush > _LOG_BATCH_SECONDS:
+            flush()
+
+    # Read large chunks and decode only complete lines, once per chunk.
+    # A read timeout flushes pending lines when the command goes quiet.
+    buffer = bytearray()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(process.stdout.read(_READ_CHUNK_SIZE), _LOG_BATCH_SECONDS)
+        except TimeoutError:
+            flush()
+            continue
+        if not chunk:
+            break
+        buffer += chunk
+        cut = buffer.rfind(b"\n")
+        if cut >= 0:
+            emit(buffer[:cut].decode(errors="replace"))
+            del buffer[:cut + 1]
+    if buffer:
+        emit(buffer.decode(errors="replace"))
+    flush()
+
+    await process.wait()
+    return process.returncode, output_lines
+
+def _load_aws_credentials(block_name: str) -> AwsCredentials:
+    """
+    Load an AwsCredentials block, cached per block for _CREDS_TTL_SECONDS.
+    """
+    with _cache_lock:
+        cached = _creds_cache.get(block_name)
+    if cached and time.monotonic() - cached[0] < _CREDS_TTL_SECONDS:
+        return cached[1]
+
+    # Load outside the lock so different blocks load in parallel
+    credentials = AwsCredentials.load(block_name)
+    with _cache_lock:
+        _creds_cache[block_name] = (time.monotonic(), credentials)
+    return credentials
+
+def _block_secrets(block_name: str) -> tuple[str, str, str]:
+    """
+    Return (access_key_id, secret_access_key, endpoint_url) from a cached
+    AwsCredentials block, unwrapping SecretStr values.
+
+    Raises:
+        ValueError: If the access key or secret key is missing
+    """
+    credentials = _load_aws_credentials(block_name)
+    access_key_id = credentials.aws_access_key_id
+    secret_access_key = credentials.aws_secret_access_key
+
+    # Handle SecretStr objects if they are used
+    if hasattr(access_key_id, 'get_secret_value'):
+        access_key_id = access_key_id.get_secret_value()
+    if hasattr(secret_access_key, 'get_secret_value'):
+        secret_access_key = secret_access_key.get_secret_value()
+
+    if not access_key_id or not secret_access_key:
+        raise ValueError(f"Missing access key or secret key in credentials block: {block_name}")
+
+    endpoint_url = getattr(credentials.aws_client_parameters, "endpoint_url", None)
+    return access_key_id, secret_access_key, endpoint_url
+
+def _get_s3_client(block_name: str):
+    """
+    Return the S3 client for an AwsCredentials block, built once per block and
+    rebuilt when a reload of the block brings a new endpoint or rotated keys.
+    Adaptive retries ride out MinIO's 503 SlowDown responses.
+    """
+    access_key_id, secret_access_key, endpoint_url = _block_secrets(block_name)
+    credentials = _load_aws_credentials(block_name)
+    identity = (endpoint_url, access_key_id, secret_access_key)
+
+    with _cache_lock:
+        cached = _s3_client_cache.get(block_name)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+
+    s3_client = credentials.get_boto3_session().client(
+        's3',
+        endpoint_url=endpoint_url,
+        config=Config(
+            max_pool_connections=64,
+            retries={'mode': 'adaptive', 'max_attempts': 5},
+            tcp_keepalive=True
+        )
+    )
+    with _cache_lock:
+        # Keep the other client if another thread raced us to the same credentials
+        cached = _s3_client_cache.get(block_name)
+        if cached is not None and cached[0] == identity:
+            return cached[1]
+        _s3_client_cache[block_name] = (identity, s3_client)
+        return s3_client
+
+def _write_rclone_config(config_path: Path, access_key_id: str,
+                         secret_access_key: str, endpoint_url: str) -> bool:
+    """
+    Write an rclone config with an "r2" remote, readable only by the owner.
+    The file is replaced atomically and left alone if it is already current.
+
+    Returns:
+        True if the file was (re)written
+    """
+    config = (
+        "[r2]\n"
+        "type = s3\n"
+        "provider = Cloudflare\n"
+        f"access_key_id = {access_key_id}\n"
+        f"secret_access_key = {secret_access_key}\n"
+        f"endpoint = {endpoint_url}\n"
+        "no_head_object = true\n"
+        "no_check_bucket = true\n"  # the bucket exists; skip the check at startup
+    )
+    try:
+        if config_path.read_text() == config:
+            return False
+    except FileNotFoundError:
+        pass
+
+    config_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    tmp_path = config_path.with_suffix(".tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(config)
+    tmp_path.replace(config_path)
+    return True
+
+@lru_cache(maxsize=1)
+def _evidence_scripts() -> dict:
+    """Read the npm scripts from evidence/package.json once"""
+    package_json = _EVIDENCE_DIR / "package.json"
+    return json.loads(package_json.read_text()).get("scripts", {})
+
+def _evidence_command(script: str) -> list:
+    """
+    Resolve an npm script of the Evidence project to a direct node invocation,
+    skipping the npm wrapper process. Falls back to `npm run` if the script is
+    not a plain call to a binary installed in node_modules/.bin.
+
+    Args:
+        script: Name of the npm script (e.g. "sources", "build")
+
+    Returns:
+        Command and arguments
+    """
+    evidence_dir = _EVIDENCE_DIR
+    argv = shlex.split(_evidence_scripts().get(script, ""))
+    if argv:
+        bin_path = evidence_dir / "node_modules" / ".bin" / argv[0]
+        if bin_path.exists():
+            return ["node", f"--max-old-space-size={_NODE_MAX_OLD_SPACE_MB}",
+                    str(bin_path.resolve()), *argv[1:]]
+    return ["npm", "run", script]
+
+@lru_cache(maxsize=None)
+def _which(tool: str) -> str | None:
+    """shutil.which, memoized for the life of the worker process"""
+    return shutil.which(tool)
+
+def _check_tool(tool: str, logger, required: bool = True) -> tuple[dict, str | None]:
+    """Check that a command-line tool is on PATH; a missing optional tool is only a warning"""
+    tool_path = _which(tool)
+    if tool_path:
+        logger.info(f"✓ {tool} found at: {tool_path}")
+        return {f"{tool}_installed": True, f"{tool}_path": tool_path}, None
+
+    if not required:
+        logger.warning(f"ℹ {tool} not found in PATH")
+        return {f"{tool}_installed": False}, None
+
+    error = f"✗ {tool} not found in PATH"
+    logger.error(error)
+    return {f"{tool}_installed": False}, error
+
+def _check_s3(key: str, label: str, block_name: str, bucket: str, logger) -> tuple[dict, str | None]:
+    """Check that a credentials block can list the given bucket"""
+    logger.info(f"Validating {label} credentials block: {block_name}")
+    try:
+        _, _, endpoint_url = _block_secrets(block_name)
+        logger.info(f"  {label} endpoint: {endpoint_url}")
+
+        # Test connection; this also leaves the block's client in _s3_client_cache
+        _get_s3_client(block_name).list_objects_v2(Bucket=bucket, MaxKeys=1)
+
+        logger.info(f"✓ {label} credentials valid, bucket '{bucket}' accessible")
+        return {f"{key}_credentials": True}, None
+    except Exception as e:
+        error = f"✗ {label} credentials test failed: {str(e)}"
+        logger.error(error)
+        return {f"{key}_credentials": False}, error
+
+def _check_versions(tools: dict, logger) -> tuple[dict, str | None]:
+    """
+    Record the versions of several commands with a single shell probe.
+    Each version is printed behind a "<cmd>:" prefix and matched by it, so a
+    command that fails or prints nothing cannot shift the others.
+    Missing commands are skipped; they are already reported by _check_tool.
+
+    Args:
+        tools: Command name -> label for log output
+    """
+    present = [cmd for cmd in tools if _which(cmd)]
+    if not present:
+        return {}, None
+
+    if os.name == "nt":
+        probe = ["cmd", "/c", " & ".join(
+            f"for /f \"delims=\" %v in ('{cmd} --version') do @echo {cmd}:%v" for cmd in present
+        )]
+    else:
+        probe = ["sh", "-c", "; ".join(f'echo "{cmd}:$({cmd} --version)"' for cmd in present)]
+
+    try:
+        lines = subprocess.check_output(probe, text=True).splitlines()
+    except Exception as e:
+        logger.warning(f"Could not get {', '.join(tools[cmd] for cmd in present)} versions: {e}")
+        return {}, None
+
+    results = {}
+    for line in lines:
+        cmd, _, version = line.partition(":")
+        version = version.strip()
+        if cmd in present and version and f"{cmd}_version" not in results:
+            logger.info(f"  {tools[cmd]} version: {version}")
+            results[f"{cmd}_version"] = version
+    for cmd in present:
+        if f"{cmd}_version" not in results:
+            logger.warning(f"Could not get {tools[cmd]} version")
+    return results, None
 
 @task(name="Validate environment", retries=0)
 def validate_environment(minio_credentials_block: str,
@@ -31,111 +401,46 @@ def validate_environment(minio_credentials_block: str,
 
     logger.info("Starting environment validation...")
 
-    # Check required command-line tools
-    required_tools = ['rclone', 'node', 'npm', 'dbt']
-    for tool in required_tools:
-        tool_path = shutil.which(tool)
-        if tool_path:
-            logger.info(f"✓ {tool} found at: {tool_path}")
-            validation_results[f"{tool}_installed"] = True
-            validation_results[f"{tool}_path"] = tool_path
-        else:
-            error = f"✗ {tool} not found in PATH"
-            logger.error(error)
-            errors.append(error)
-            validation_results[f"{tool}_installed"] = False
-
-    # Check directory structure
-    base_dir = Path(__file__).parent
-    required_dirs = {
-        'dbt': base_dir / "dbt",
-        'evidence': base_dir / "evidence",
-        'evidence_build': base_dir / "evidence" / "build"
-    }
+    # Tool, bucket and version checks are independent; run them side by side
+    # dbt runs in-process, so only its Python package is needed
+    # rclone is optional: without it deploy_to_r2 falls back to boto3
+    required_tools = ['node', 'npm']
+    with ThreadPoolExecutor(max_workers=_VALIDATION_WORKERS) as executor:
+        futures = [executor.submit(_check_tool, tool, logger) for tool in required_tools]
+        futures.append(executor.submit(_check_tool, 'rclone', logger, required=False))
+        futures += [
+            executor.submit(_check_s3, "minio", "MinIO", minio_credentials_block, minio_bucket, logger),
+            executor.submit(_check_s3, "r2", "R2", r2_credentials_block, r2_bucket, logger),
+            executor.submit(_check_versions, {"node": "Node.js", "npm": "npm"}, logger),
+        ]
+
+        # Check directory structure meanwhile
+        required_dirs = {
+            'dbt': _DBT_DIR,
+            'evidence': _EVIDENCE_DIR,
+            'evidence_build': _BUILD_DIR
+        }
 
-    for name, dir_path in required_dirs.items():
-        if dir_path.exists():
-            logger.info(f"✓ Directory exists: {dir_path}")
-            validation_results[f"dir_{name}"] = True
-        else:
-            if name == 'evidence_build':
-                # Build directory is expected to not exist initially, just log
-                logger.info(f"ℹ Build directory will be created: {dir_path}")
-                validation_results[f"dir_{name}"] = False
+        for name, dir_path in required_dirs.items():
+            if dir_path.exists():
+                logger.info(f"✓ Directory exists: {dir_path}")
+                validation_results[f"dir_{name}"] = True
             else:
-                error = f"✗ Required directory missing: {dir_path}"
-                logger.error(error)
+                if name == 'evidence_build':
+                    # Build directory is expected to not exist initially, just log
+                    logger.info(f"ℹ Build directory will be created: {dir_path}")
+                    validation_results[f"dir_{name}"] = False
+                else:
+                    error = f"✗ Required directory missing: {dir_path}"
+                    logger.error(error)
+                    errors.append(error)
+                    validation_results[f"dir_{name}"] = False
+
+        for future in as_completed(futures):
+            results, error = future.result()
+            validation_results.update(results)
+            if error:
                 errors.append(error)
-                validation_results[f"dir_{name}"] = False
-
-    # Validate MinIO credentials
-    logger.info(f"Validating MinIO credentials block: {minio_credentials_block}")
-    try:
-        minio_creds = AwsCredentials.load(minio_credentials_block)
-
-        # Get endpoint
-        endpoint_url = None
-        if minio_creds.aws_client_parameters:
-            client_params = minio_creds.aws_client_parameters.model_dump()
-            endpoint_url = client_params.get("endpoint_url")
-
-        logger.info(f"  MinIO endpoint: {endpoint_url}")
-
-        # Test connection
-        boto3_session = minio_creds.get_boto3_session()
-        s3_client = boto3_session.client('s3', endpoint_url=endpoint_url)
-        s3_client.list_objects_v2(Bucket=minio_bucket, MaxKeys=1)
-
-        logger.info(f"✓ MinIO credentials valid, bucket '{minio_bucket}' accessible")
-        validation_results["minio_credentials"] = True
-    except Exception as e:
-        error = f"✗ MinIO credentials test failed: {str(e)}"
-        logger.error(error)
-        errors.append(error)
-        validation_results["minio_credentials"] = False
-
-    # Validate R2 credentials
-    logger.info(f"Validating R2 credentials block: {r2_credentials_block}")
-    try:
-        r2_creds = AwsCredentials.load(r2_credentials_block)
-
-        # Get endpoint
-        endpoint_url = None
-        if r2_creds.aws_client_parameters:
-            client_params = r2_creds.aws_client_parameters.model_dump()
-            endpoint_url = client_params.get("endpoint_url")
-
-        logger.info(f"  R2 endpoint: {endpoint_url}")
-
-        # Test connection
-        boto3_session = r2_creds.get_boto3_session()
-        s3_client = boto3_session.client('s3', endpoint_url=endpoint_url)
-        s3_client.list_objects_v2(Bucket=r2_bucket, MaxKeys=1)
-
-        logger.info(f"✓ R2 credentials valid, bucket '{r2_bucket}' accessible")
-        validation_results["r2_credentials"] = True
-    except Exception as e:
-        error = f"✗ R2 credentials test failed: {str(e)}"
-        logger.error(error)
-        errors.append(error)
-        validation_results["r2_credentials"] = False
-
-    # Check Node.js and npm versions
-    if validation_results.get("node_installed"):
-        try:
-            node_version = subprocess.check_output(["node", "--version"], text=True).strip()
-            logger.info(f"  Node.js version: {node_version}")
-            validation_results["node_version"] = node_version
-        except Exception as e:
-            logger.warning(f"Could not get Node.js version: {e}")
-
-    if validation_results.get("npm_installed"):
-        try:
-            npm_version = subprocess.check_output(["npm", "--version"], text=True).strip()
-            logger.info(f"  npm version: {npm_version}")
-            validation_results["npm_version"] = npm_version
-        except Exception as e:
-            logger.warning(f"Could not get npm version: {e}")
 
     # Summary
     if errors:
@@ -153,66 +458,99 @@ def validate_environment(minio_credentials_block: str,
     return validation_results
 
 @task(name="Initialize Evidence", retries=0)
-def init_evidence() -> str:
+async def init_evidence() -> str:
     """
-    Initialize Evidence by running npm install if needed.
-    This ensures all dependencies are available for the build.
+    Initialize Evidence by installing its npm dependencies if needed.
+
+    Installs are skipped while node_modules is newer than package-lock.json.
+    With a lockfile, `npm ci` installs exactly what it pins; otherwise
+    `npm install` resolves the tree.
 
     Returns:
         Status string
     """
     logger = get_run_logger()
-    evidence_dir = Path(__file__).parent / "evidence"
+    evidence_dir = _EVIDENCE_DIR
     package_json = evidence_dir / "package.json"
+    package_lock = evidence_dir / "package-lock.json"
+    installed_lock = evidence_dir / "node_modules" / ".package-lock.json"
 
     if not package_json.exists():
         logger.warning("No package.json found, skipping npm install")
         return "skipped - no package.json"
 
-    # Always run npm install to ensure dependencies are up to date
-    logger.info("Running npm install to ensure dependencies are current...")
+    if (package_lock.exists() and installed_lock.exists()
+            and installed_lock.stat().st_mtime >= package_lock.stat().st_mtime):
+        logger.info("node_modules is up to date with package-lock.json, skipping install")
+        return "up to date"
 
-    process = subprocess.Popen(
-        ["npm", "install"],
-        cwd=evidence_dir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
+    if package_lock.exists():
+        cmd = ["npm", "ci", "--prefer-offline", "--no-audit", "--no-fund"]
+    else:
+        cmd = ["npm", "install", "--no-audit", "--no-fund"]
 
-    # Stream output
-    output_lines = []
-    for line in process.stdout:
-        line = line.rstrip()
-        logger.info(line)
-        output_lines.append(line)
+    npm_env = os.environ.copy()
+    npm_env["NPM_CONFIG_UPDATE_NOTIFIER"] = "false"
+    npm_env["NPM_CONFIG_FUND"] = "false"
 
-    process.wait()
+    logger.info(f"Running {' '.join(cmd)}...")
+
+    returncode, output_lines = await _stream_subprocess(
+        cmd,
+        cwd=evidence_dir,
+        logger=logger,
+        env=npm_env
+    )
 
-    if process.returncode != 0:
-        error_msg = f"npm install failed with return code {process.returncode}"
+    if returncode != 0:
+        error_msg = f"{' '.join(cmd[:2])} failed with return code {returncode}"
         logger.error(error_msg)
         raise subprocess.CalledProcessError(
-            process.returncode,
-            ["npm", "install"],
+            returncode,
+            cmd,
             output="\n".join(output_lines)
         )
 
     logger.info("Evidence dependencies initialized successfully!")
     return "initialized"
 
+def _get_duckdb() -> duckdb.DuckDBPyConnection:
+    """
+    Return the shared in-memory DuckDB connection, opening it and loading
+    httpfs on first use. Callers should work on a .cursor() of it.
+    """
+    global _duckdb_conn
+    with _cache_lock:
+        if _duckdb_conn is None:
+            conn = duckdb.connect(':memory:')
+            conn.execute("INSTALL httpfs; LOAD httpfs;")
+            _duckdb_conn = conn
+            atexit.register(_duckdb_conn.close)
+        return _duckdb_conn
+
+def _sql_quote(value: str) -> str:
+    """Quote a value as a SQL string literal"""
+    return "'" + value.replace("'", "''") + "'"
+
 @task(name="Setup DuckDB secrets", retries=0)
 def setup_duckdb_secrets(minio_credentials_block: str,
-                         bucket_name: str = "ipfix") -> dict:
+                         bucket_name: str = "ipfix",
+                         verify: bool = False,
+                         deep_verify: bool = False) -> dict:
     """
     Configure DuckDB persistent secret for S3/MinIO access.
     This allows dbt models to read parquet files directly from MinIO.
-    Uses in-memory database - secrets persist in separate user database.
+    Uses the shared in-memory database - secrets persist in separate user database.
+
+    The S3 access test only runs when the secret is newly created or verify
+    is set; dbt reads the same files next. It is a single LIST via glob();
+    deep_verify also counts records, which reads every parquet footer.
 
     Args:
         minio_credentials_block: Name of the Prefect AwsCredentials block for MinIO access
         bucket_name: Name of the S3/MinIO bucket (default: "ipfix")
+        verify: Run the S3 access test even if the secret already exists (default: False)
+        deep_verify: Also count records across all parquet files (default: False)
 
     Returns:
         Dictionary with setup results
@@ -221,46 +559,29 @@ def setup_duckdb_secrets(minio_credentials_block: str,
 
     logger.info(f"Setting up DuckDB secrets for MinIO access...")
 
-    # Load MinIO credentials from Prefect block
-    logger.info(f"Loading MinIO credentials from block: {minio_credentials_block}")
-    minio_creds = AwsCredentials.load(minio_credentials_block)
-
-    # Get endpoint URL
-    endpoint_url = None
-    if minio_creds.aws_client_parameters:
-        client_params = minio_creds.aws_client_parameters.model_dump()
-        endpoint_url = client_params.get("endpoint_url")
-
-    # Extract credentials
-    access_key_id = minio_creds.aws_access_key_id
-    secret_access_key = minio_creds.aws_secret_access_key
-
-    # Handle SecretStr objects
-    if hasattr(access_key_id, 'get_secret_value'):
-        access_key_id = access_key_id.get_secret_value()
-    if hasattr(secret_access_key, 'get_secret_value'):
-        secret_access_key = secret_access_key.get_secret_value()
-
-    if not access_key_id or not secret_access_key or not endpoint_url:
-        raise ValueError("Missing access key, secret key, or endpoint in credentials block")
+    # MinIO credentials from the (cached) Prefect block
+    access_key_id, secret_access_key, endpoint_url = _block_secrets(minio_credentials_block)
+    if not endpoint_url:
+        raise ValueError("Missing endpoint in credentials block")
 
     # Strip protocol from endpoint - DuckDB wants just the domain
     endpoint_domain = endpoint_url.replace('https://', '').replace('http://', '')
     logger.info(f"MinIO endpoint: {endpoint_url} -> {endpoint_domain}")
 
-    # Connect to in-memory DuckDB - secrets persist in user database
-    conn = duckdb.connect(':memory:')
+    # Cursor on the shared in-memory DuckDB - secrets persist in user database
+    conn = _get_duckdb().cursor()
 
     try:
         # Try to create persistent secret, skip if already exists
         logger.info("Creating persistent S3 secret (or using existing)...")
         try:
+            # CREATE SECRET does not take bound parameters, so quote the values
             conn.execute(f"""
                 CREATE PERSISTENT SECRET minio_secret (
                     TYPE S3,
-                    KEY_ID '{access_key_id}',
-                    SECRET '{secret_access_key}',
-                    ENDPOINT '{endpoint_domain}'
+                    KEY_ID {_sql_quote(access_key_id)},
+                    SECRET {_sql_quote(secret_access_key)},
+                    ENDPOINT {_sql_quote(endpoint_domain)}
                 )
             """)
             logger.info("✓ Secret created successfully")
@@ -272,17 +593,28 @@ def setup_duckdb_secrets(minio_credentials_block: str,
             else:
                 raise
 
-        # Test the connection by counting records
-        logger.info(f"Testing S3 access by counting records in s3://{bucket_name}/ipfix_*.parquet...")
-        result = conn.execute(f"SELECT count(*) as cnt FROM read_parquet('s3://{bucket_name}/ipfix_*.parquet')").fetchone()
-        record_count = result[0] if result else 0
-
-        logger.info(f"✓ S3 access successful! Found {record_count:,} records")
+        # Test the connection by listing the parquet files
+        file_count = None
+        record_count = None
+        parquet_glob = f"s3://{bucket_name}/ipfix_*.parquet"
+        if verify or deep_verify or secret_created:
+            logger.info(f"Testing S3 access by listing {parquet_glob}...")
+            result = conn.execute("SELECT count(*) FROM glob(?)", [parquet_glob]).fetchone()
+            file_count = result[0] if result else 0
+            logger.info(f"✓ S3 access successful! Found {file_count:,} files")
+
+            if deep_verify:
+                result = conn.execute("SELECT count(*) as cnt FROM read_parquet(?)", [parquet_glob]).fetchone()
+                record_count = result[0] if result else 0
+                logger.info(f"✓ Found {record_count:,} records")
+        else:
+            logger.info("Skipping S3 access test for existing secret")
 
         return {
             "secret_created": secret_created,
             "endpoint": endpoint_domain,
             "bucket": bucket_name,
+            "test_file_count": file_count,
             "test_record_count": record_count
         }
 
@@ -292,230 +624,639 @@ def setup_duckdb_secrets(minio_credentials_block: str,
     finally:
         conn.close()
 
+def _summarize_dbt_result(result: dbtRunnerResult) -> dict:
+    """Condense a dbt invocation into node counts per status and the slowest nodes"""
+    node_results = getattr(result.result, "results", None) or []
+    slowest = sorted(node_results, key=lambda r: r.execution_time, reverse=True)[:3]
+    return {
+        "dbt_nodes": len(node_results),
+        "statuses": dict(Counter(str(r.status) for r in node_results)),
+        "elapsed_s": round(getattr(result.result, "elapsed_time", 0) or 0, 2),
+        "slowest": {r.node.unique_id: round(r.execution_time, 2) for r in slowest},
+    }
+
 @task(name="Run dbt build", retries=2)
-def run_dbt_build() -> dict:
-    """Run dbt build to materialize all models"""
+async def run_dbt_build(changed_only: bool = False) -> dict:
+    """
+    Run dbt build in-process to materialize all models.
+
+    Every model reads the exported parquet files, so new data needs a full
+    build. With changed_only, only models modified since the last successful
+    build (and their children) are rebuilt, deferring to STATE_DIR for the rest.
+
+    Args:
+        changed_only: Build only state:modified+ models (default: False)
+
+    Returns:
+        Dictionary with the return code
+    """
     logger = get_run_logger()
-    dbt_dir = Path(__file__).parent / "dbt"
+    dbt_dir = _DBT_DIR
 
     logger.info("Starting dbt build...")
 
-    # Stream output in real-time
-    process = subprocess.Popen(
-        ["dbt", "build"],
-        cwd=dbt_dir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
+    output_lines = deque(maxlen=_OUTPUT_TAIL_LINES)
+
+    def forward_event(event):
+        # Keep dbt's log events for error reports; only warnings and errors
+        # are sent to the Prefect logger as they happen, the rest is summarized
+        if event.info.level == "debug" or not event.info.msg:
+            return
+        output_lines.append(event.info.msg)
+        if event.info.level == "error":
+            logger.error(event.info.msg)
+        elif event.info.level == "warn":
+            logger.warning(event.info.msg)
+
+    args = [
+        "build",
+        "--project-dir", str(dbt_dir),
+        "--profiles-dir", str(dbt_dir),
+        "--target-path", str(dbt_dir / "target"),
+        "--log-path", str(dbt_dir / "logs"),
+        "--no-populate-cache",
+        "--no-send-anonymous-usage-stats",
+    ]
+
+    state_manifest = STATE_DIR / "manifest.json"
+    if changed_only:
+        if state_manifest.exists():
+            logger.info(f"Building changed models only (state: {STATE_DIR})")
+            args += ["--select", "state:modified+", "--state", str(STATE_DIR), "--defer"]
+        else:
+            logger.info("No saved dbt state yet, running a full build")
 
-    # Stream and log output line by line as it happens
-    output_lines = []
-    for line in process.stdout:
-        line = line.rstrip()
-        logger.info(line)
-        output_lines.append(line)
+    # dbtRunner blocks, so keep it off the event loop
+    result: dbtRunnerResult = await asyncio.to_thread(
+        dbtRunner(callbacks=[forward_event]).invoke, args
+    )
 
-    # Wait for process to complete
-    process.wait()
+    logger.info(json.dumps(_summarize_dbt_result(result)))
 
-    if process.returncode != 0:
-        error_msg = f"dbt build failed with return code {process.returncode}"
+    if not result.success:
+        returncode = 2 if result.exception else 1
+        error_msg = f"dbt build failed with return code {returncode}"
+        if result.exception:
+            error_msg += f": {result.exception}"
         logger.error(error_msg)
-        logger.error("Full output above ^^^")
         raise subprocess.CalledProcessError(
-            process.returncode,
-            ["dbt", "build"],
+            returncode,
+            ["dbt", *args],
             output="\n".join(output_lines)
         )
 
     logger.info("dbt build completed successfully!")
 
-    return {
-        "stdout": "\n".join(output_lines),
-        "returncode": process.returncode
-    }
+    # Save the manifest for the next changed-only run
+    manifest = dbt_dir / "target" / "manifest.json"
+    if manifest.exists():
+        STATE_DIR.mkdir(exist_ok=True)
+        tmp_manifest = state_manifest.with_suffix(".tmp")
+        shutil.copyfile(manifest, tmp_manifest)
+        tmp_manifest.replace(state_manifest)
+
+    return {"returncode": 0}
+
+def _read_state_file(path: Path) -> str:
+    """Return the contents of a pipeline state file, or an empty string"""
+    try:
+        return path.read_text().strip()
+    except FileNotFoundError:
+        return ""
+
+def _write_state_file(path: Path, text: str) -> None:
+    """Atomically replace a pipeline state file"""
+    PIPELINE_CACHE_DIR.mkdir(exist_ok=True)
+    tmp_file = path.with_suffix(".tmp")
+    tmp_file.write_text(text)
+    tmp_file.replace(path)
+
+def _evidence_input_files(evidence_dir: Path, *extra: str) -> list:
+    """
+    Sorted Evidence files the site is built from: config, pages and source
+    queries, plus any extra files or directories relative to evidence_dir.
+    DuckDB database files are left out; their tables are hashed separately.
+    """
+    input_files = [evidence_dir / "evidence.config.yaml"]
+    for name in ("pages", "sources", *extra):
+        path = evidence_dir / name
+        input_files += path.rglob("*") if path.is_dir() else [path]
+    return sorted(
+        path for path in input_files
+        if path.is_file() and path.suffix not in (".duckdb", ".wal")
+    )
+
+def _hash_files(digest, base_dir: Path, paths: list) -> None:
+    """Feed each file's relative path and content hash into digest"""
+    for path in paths:
+        digest.update(str(path.relative_to(base_dir)).encode())
+        with open(path, "rb") as f:
+            digest.update(hashlib.file_digest(f, "sha256").digest())
+
+# Table names referenced by the Evidence source queries
+_SOURCE_TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?', re.IGNORECASE)
+
+def _evidence_source_tables() -> list:
+    """Names of the DuckDB tables read by the Evidence source queries"""
+    tables = set()
+    for query_file in (_EVIDENCE_DIR / "sources").rglob("*.sql"):
+        tables.update(_SOURCE_TABLE_RE.findall(query_file.read_text()))
+    return sorted(tables)
+
+@task(name="Compute content digest", retries=0)
+def compute_content_digest() -> str:
+    """
+    Hash everything the Evidence site is built from: the contents of the
+    DuckDB tables its source queries read (the marts, not the large staging
+    table), plus the Evidence pages and source queries. Row order and build
+    timestamps do not affect the digest.
+
+    If a source table is not a base table in DuckDB (renamed mart, view
+    materialization), a random digest is returned so the build and deploy
+    still run instead of being skipped on a digest that cannot change.
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    logger = get_run_logger()
+    evidence_dir = _EVIDENCE_DIR
+
+    digest = hashlib.sha256()
+    source_tables = _evidence_source_tables()
+
+    conn = duckdb.connect(str(_DUCKDB_PATH), read_only=True)
+    try:
+        tables = conn.execute("""
+            SELECT table_schema, table_name
+            FROM information_schema.tables
+            WHERE table_type = 'BASE TABLE'
+              AND table_name IN (SELECT unnest(?))
+            ORDER BY table_schema, table_name
+        """, [source_tables]).fetchall()
+        missing = set(source_tables) - {table for _, table in tables}
+        if missing:
+            logger.warning(f"Evidence source table(s) not found as DuckDB base tables: "
+                           f"{', '.join(sorted(missing))}; forcing a rebuild")
+            return os.urandom(32).hex()
+        for schema, table in tables:
+            row_count, row_hash = conn.execute(
+                f'SELECT count(*), sum(hash(t)) FROM "{schema}"."{table}" t'
+            ).fetchone()
+            digest.update(f"{schema}.{table}:{row_count}:{row_hash}\n".encode())
+    finally:
+        conn.close()
+
+    _hash_files(digest, evidence_dir, _evidence_input_files(evidence_dir))
+
+    content_digest = digest.hexdigest()
+    logger.info(f"Content digest: {content_digest} ({len(tables)} tables)")
+    return content_digest
+
+def _build_index_file(bucket_name: str) -> Path:
+    """Path of the build index for a bucket"""
+    return PIPELINE_CACHE_DIR / BUILD_INDEX_FILE_TEMPLATE.format(bucket=bucket_name)
+
+def _read_build_index(bucket_name: str, endpoint_url: str) -> dict:
+    """
+    Return the index of the last build deployed to the bucket, or an empty dict
+    when there is none or it was recorded for a different endpoint
+    """
+    try:
+        stored = json.loads(_read_state_file(_build_index_file(bucket_name)) or "{}")
+    except ValueError:
+        return {}
+    if stored.get("endpoint") != endpoint_url:
+        return {}
+    return stored.get("files", {})
+
+def _write_build_index(bucket_name: str, endpoint_url: str, index: dict) -> None:
+    """Atomically record the index of a build deployed to the bucket"""
+    _write_state_file(_build_index_file(bucket_name),
+                      json.dumps({"endpoint": endpoint_url, "files": index}))
+
+def _md5_file(path: str) -> str:
+    """MD5 of a file, the same digest S3 uses as a single-part ETag"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "md5").hexdigest()
+
+def _scan_build_dir(build_dir: Path, previous: dict) -> dict:
+    """
+    Index every file under build_dir as relpath -> [size, mtime_ns, md5].
+    Files whose size and mtime match the previous index reuse its hash;
+    the rest are hashed in parallel (hashlib releases the GIL).
+    """
+    index = {}
+    to_hash = []
+    pending_dirs = [build_dir]
+    while pending_dirs:
+        with os.scandir(pending_dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+                    continue
+                if entry.name == ".DS_Store":
+                    continue
+                st = entry.stat()
+                rel_path = Path(entry.path).relative_to(build_dir).as_posix()
+                old = previous.get(rel_path)
+                if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                    index[rel_path] = old
+                else:
+                    index[rel_path] = [st.st_size, st.st_mtime_ns, None]
+                    to_hash.append((rel_path, entry.path))
+
+    with ThreadPoolExecutor(max_workers=_HASH_WORKERS) as executor:
+        digests = executor.map(_md5_file, [path for _, path in to_hash])
+        for (rel_path, _), digest in zip(to_hash, digests):
+            index[rel_path][2] = digest
+    return index
+
+@task(name="Prewarm DuckDB", retries=0)
+def prewarm_duckdb(db_path: str = None) -> int:
+    """
+    Pull the DuckDB file into the OS page cache so Evidence source queries
+    start from memory on a cold worker. Best effort: failures are only logged.
+
+    Args:
+        db_path: Path to the DuckDB file (default: the Evidence ipfix source database)
+
+    Returns:
+        Number of bytes warmed
+    """
+    logger = get_run_logger()
+    path = Path(db_path) if db_path else _DUCKDB_PATH
+
+    try:
+        size = path.stat().st_size
+        if size == 0:
+            return 0
+        with open(path, "rb") as f:
+            if hasattr(mmap, "MAP_POPULATE"):
+                # Linux: the kernel faults in every page before mmap returns
+                with mmap.mmap(f.fileno(), 0, flags=mmap.MAP_SHARED | mmap.MAP_POPULATE, prot=mmap.PROT_READ):
+                    pass
+            else:
+                while f.read(_PREWARM_CHUNK_SIZE):
+                    pass
+    except OSError as e:
+        logger.warning(f"Could not prewarm {path}: {e}")
+        return 0
+
+    logger.info(f"Prewarmed {path} ({size / (1024**2):.2f} MB)")
+    return size
 
 @task(name="Refresh Evidence sources")
-def refresh_evidence_sources() -> str:
+async def refresh_evidence_sources() -> str:
     """
-    Run npm run sources to refresh Evidence source queries.
+    Run the Evidence sources script to refresh Evidence source queries.
     """
     logger = get_run_logger()
-    evidence_dir = Path(__file__).parent / "evidence"
+    evidence_dir = _EVIDENCE_DIR
+    cmd = _evidence_command("sources")
 
-    logger.info("Running npm run sources...")
+    logger.info(f"Running {' '.join(cmd)}...")
 
-    process = subprocess.Popen(
-        ["npm", "run", "sources"],
+    returncode, output_lines = await _stream_subprocess(
+        cmd,
         cwd=evidence_dir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
+        logger=logger
     )
 
-    # Stream output
-    output_lines = []
-    for line in process.stdout:
-        line = line.rstrip()
-        logger.info(line)
-        output_lines.append(line)
-
-    process.wait()
-
-    if process.returncode != 0:
-        error_msg = f"npm run sources failed with return code {process.returncode}"
+    if returncode != 0:
+        error_msg = f"Evidence sources failed with return code {returncode}"
         logger.error(error_msg)
         raise subprocess.CalledProcessError(
-            process.returncode,
-            ["npm", "run", "sources"],
+            returncode,
+            cmd,
             output="\n".join(output_lines)
         )
 
     logger.info("Evidence sources refreshed successfully!")
     return "sources refreshed"
 
+def _hash_build_inputs(evidence_dir: Path) -> str:
+    """
+    Hash everything `evidence build` reads: pages, source queries, config,
+    the lockfile and the query results written by the sources step. Only
+    file contents count, since the sources step rewrites its output every run.
+    """
+    digest = hashlib.sha256()
+    _hash_files(digest, evidence_dir, _evidence_input_files(
+        evidence_dir, "package-lock.json", ".evidence/template/static/data"
+    ))
+    return digest.hexdigest()
+
 @task(name="Build Evidence")
-def build_evidence() -> str:
+async def build_evidence(force: bool = False) -> str:
     """
-    Run npm run build to rebuild Evidence site.
+    Run the Evidence build script to rebuild Evidence site.
+
+    The build is skipped when build/ is present and its inputs hash the same
+    as at the last successful build.
+
+    Args:
+        force: Build even if the inputs are unchanged (default: False)
     """
     logger = get_run_logger()
-    evidence_dir = Path(__file__).parent / "evidence"
+    evidence_dir = _EVIDENCE_DIR
+    cmd = _evidence_command("build")
 
-    logger.info("Running npm run build...")
+    inputs_hash = await asyncio.to_thread(_hash_build_inputs, evidence_dir)
+    if not force and inputs_hash == _read_state_file(BUILD_INPUTS_HASH_FILE) and (_BUILD_DIR / "index.html").exists():
+        logger.info("Evidence build inputs unchanged, reusing existing build/")
+        return "build cached"
 
-    process = subprocess.Popen(
-        ["npm", "run", "build"],
-        cwd=evidence_dir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
+    build_env = os.environ.copy()
+    build_env["NODE_ENV"] = "production"
 
-    # Stream output
-    output_lines = []
-    for line in process.stdout:
-        line = line.rstrip()
-        logger.info(line)
-        output_lines.append(line)
+    logger.info(f"Running {' '.join(cmd)}...")
 
-    process.wait()
+    returncode, output_lines = await _stream_subprocess(
+        cmd,
+        cwd=evidence_dir,
+        logger=logger,
+        env=build_env
+    )
 
-    if process.returncode != 0:
-        error_msg = f"npm run build failed with return code {process.returncode}"
+    if returncode != 0:
+        error_msg = f"Evidence build failed with return code {returncode}"
         logger.error(error_msg)
         raise subprocess.CalledProcessError(
-            process.returncode,
-            ["npm", "run", "build"],
+            returncode,
+            cmd,
             output="\n".join(output_lines)
         )
 
+    _write_state_file(BUILD_INPUTS_HASH_FILE, inputs_hash)
+
     logger.info("Evidence build completed successfully!")
     return "build completed"
 
 @task(name="Deploy to R2", retries=2)
-def deploy_to_r2(aws_credentials_block: str,
-                 bucket_name: str = "ipfix-analytics") -> str:
+async def deploy_to_r2(aws_credentials_block: str,
+                       bucket_name: str = "ipfix-analytics",
+                       fast_deploy: bool = False,
+                       engine: str = "rclone") -> str:
     """
     Deploy Evidence build directory to Cloudflare R2 using rclone.
-    Credentials are loaded from Prefect block and used to configure rclone on-the-fly.
+    Credentials are loaded from Prefect block and written to a project-local
+    rclone config (evidence/.rclone/rclone.conf), which is only rewritten
+    when they change.
+
+    With engine="boto3" the upload runs in-process instead, reusing the block's
+    boto3 session: one bucket listing, then parallel PUTs of files whose ETag
+    (or size, for multipart objects) differs, then removal of stale keys.
+    This engine is also used when rclone is not installed.
+
+    When an index of the build previously deployed to the same bucket and
+    endpoint exists, only files whose content changed are handed to rclone via
+    --files-from, and files removed since then are deleted with a scoped
+    `rclone delete`. Without one, a full sync runs and records the index.
+
+    With fast_deploy, rclone copies without listing the bucket and compares by
+    size only. Evidence asset names are content-hashed, so this skips the
+    bucket LIST and checksum reads; stale files are not removed in this mode.
 
     Args:
         aws_credentials_block: Name of the Prefect AwsCredentials block for R2 access
         bucket_name: Name of the R2 bucket (default: "ipfix-analytics")
+        fast_deploy: Copy with --no-traverse --size-only instead of a full checksum sync (default: False)
+        engine: "rclone" or "boto3" (default: "rclone")
 
     Returns:
         Status string
     """
     logger = get_run_logger()
-    evidence_dir = Path(__file__).parent / "evidence"
-    build_dir = evidence_dir / "build"
+    evidence_dir = _EVIDENCE_DIR
+    build_dir = _BUILD_DIR
 
     if not build_dir.exists():
         raise FileNotFoundError(f"Build directory not found: {build_dir}")
 
     logger.info(f"Deploying {build_dir} to R2 bucket '{bucket_name}'...")
 
-    # Load R2 credentials from Prefect block
-    logger.info(f"Loading R2 credentials from block: {aws_credentials_block}")
-    aws_credentials = AwsCredentials.load(aws_credentials_block)
+    # R2 credentials from the (cached) Prefect block
+    access_key_id, secret_access_key, endpoint_url = _block_secrets(aws_credentials_block)
+    logger.info(f"R2 endpoint: {endpoint_url}")
 
-    # Get endpoint configuration
-    endpoint_url = None
-    if aws_credentials.aws_client_parameters:
-        client_params = aws_credentials.aws_client_parameters.model_dump()
-        endpoint_url = client_params.get("endpoint_url")
+    if engine == "rclone" and not _which("rclone"):
+        logger.warning("rclone not found in PATH, deploying with boto3 instead")
+        engine = "boto3"
 
-    logger.info(f"R2 endpoint: {endpoint_url}")
+    if engine == "boto3":
+        s3_client = _get_s3_client(aws_credentials_block)
+        uploaded, unchanged, deleted = await asyncio.to_thread(
+            _upload_with_boto3, s3_client, build_dir, bucket_name, logger, not fast_deploy
+        )
+        # This engine keeps no build index, so the next rclone deploy does a full sync
+        _build_index_file(bucket_name).unlink(missing_ok=True)
+        logger.info(f"Deployment to R2 completed successfully! "
+                    f"{uploaded} uploaded, {unchanged} unchanged, {deleted} deleted")
+        return "deployed to R2"
+    if engine != "rclone":
+        raise ValueError(f"Unknown deploy engine: {engine}")
+
+    # Configure the "r2" remote in a private config file
+    rclone_config = evidence_dir / ".rclone" / "rclone.conf"
+    if _write_rclone_config(rclone_config, access_key_id, secret_access_key, endpoint_url):
+        logger.info(f"Wrote rclone config with credentials from Prefect block: {rclone_config}")
+    else:
+        logger.info(f"Using existing rclone config: {rclone_config}")
+
+    # Diff the build against the last one deployed to this bucket
+    previous_index = _read_build_index(bucket_name, endpoint_url)
+    build_index = await asyncio.to_thread(_scan_build_dir, build_dir, previous_index)
+    changed_files = [
+        rel_path for rel_path, entry in build_index.items()
+        if previous_index.get(rel_path, [None, None, None])[2] != entry[2]
+    ]
+    removed_files = previous_index.keys() - build_index.keys()
+
+    destination = f"r2:{bucket_name}"
+    if previous_index:
+        if not changed_files and not removed_files:
+            logger.info("Build is identical to the last deployed one, nothing to upload")
+            _write_build_index(bucket_name, endpoint_url, build_index)
+            return "deployed to R2 (no changes)"
+        logger.info(f"{len(changed_files)} of {len(build_index)} file(s) changed, "
+                    f"{len(removed_files)} removed since last deploy")
+        # Upload first so pages never reference deleted assets. rclone refuses
+        # other filter flags next to --files-from; the lists never contain
+        # .DS_Store since _scan_build_dir skips it
+        rclone_runs = []
+        if changed_files:
+            changed_list = PIPELINE_CACHE_DIR / "changed_files.txt"
+            changed_list.write_text("\n".join(changed_files) + "\n")
+            rclone_runs.append(["copy", "build/", destination, "--files-from", str(changed_list),
+                                "--no-traverse", "--no-check-dest"])
+        if removed_files:
+            removed_list = PIPELINE_CACHE_DIR / "removed_files.txt"
+            removed_list.write_text("\n".join(sorted(removed_files)) + "\n")
+            rclone_runs.append(["delete", destination, "--files-from", str(removed_list)])
+    elif fast_deploy:
+        # --no-traverse cannot be combined with sync, which has to list the destination
+        rclone_runs = [["copy", "build/", destination, "--no-traverse", "--size-only",
+                        "--exclude", ".DS_Store"]]
+    else:
+        # one recursive listing instead of one per directory
+        rclone_runs = [["sync", "build/", destination, "--checksum", "--fast-list",
+                        "--exclude", ".DS_Store"]]
+
+    # rclone logs one JSON object per line; count transfers and only forward
+    # warnings, errors and periodic stats to the Prefect logger
+    summary = Counter()
+
+    def handle_rclone_line(line: str):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            logger.info(line)
+            return
+        level = entry.get("level", "info")
+        msg = entry.get("msg", "")
+        if level in ("error", "critical"):
+            summary["errors"] += 1
+            logger.error(msg)
+        elif level == "warning":
+            logger.warning(msg)
+        elif "stats" in entry:
+            summary["bytes"] = entry["stats"].get("bytes", 0)
+            logger.info(msg.strip())
+        elif msg.startswith("Copied"):
+            summary["copied"] += 1
+        elif msg.startswith("Deleted"):
+            summary["deleted"] += 1
+
+    for rclone_run in rclone_runs:
+        returncode, output_lines = await _stream_subprocess(
+            [
+                "rclone", rclone_run[0],
+                "--config", str(rclone_config),
+                *rclone_run[1:],
+                "-v",
+                "--transfers", "32",        # Evidence builds are many small files
+                "--checkers", "64",
+                "--s3-no-head",             # skip the HEAD after each upload
+                "--s3-chunk-size", "16M",
+                "--s3-upload-concurrency", "8",
+                "--buffer-size", "16M",
+                "--use-mmap",               # return transfer buffers to the OS promptly
+                "--stats", "30s",
+                "--stats-one-line",         # plain periodic stats instead of --progress redraws
+                "--use-json-log"
+            ],
+            cwd=evidence_dir,
+            logger=logger,
+            handle_line=handle_rclone_line
+        )
 
-    # Get credentials from block
-    access_key_id = aws_credentials.aws_access_key_id
-    secret_access_key = aws_credentials.aws_secret_access_key
+        if returncode != 0:
+            error_msg = f"rclone {rclone_run[0]} failed with return code {returncode}"
+            logger.error(error_msg)
+            raise subprocess.CalledProcessError(
+                returncode,
+                ["rclone", rclone_run[0]],
+                output="\n".join(output_lines)
+            )
 
-    # Handle SecretStr objects if they are used
-    if hasattr(access_key_id, 'get_secret_value'):
-        access_key_id = access_key_id.get_secret_value()
-    if hasattr(secret_access_key, 'get_secret_value'):
-        secret_access_key = secret_access_key.get_secret_value()
+    logger.info(json.dumps({"rclone": [run[0] for run in rclone_runs], **summary}))
 
-    if not access_key_id or not secret_access_key:
-        raise ValueError("Missing access key or secret key in credentials block")
-
-    # Configure rclone via environment variables
-    # This creates a temporary "r2" remote configuration for this process
-    rclone_env = os.environ.copy()
-    rclone_env['RCLONE_CONFIG_R2_TYPE'] = 's3'
-    rclone_env['RCLONE_CONFIG_R2_PROVIDER'] = 'Cloudflare'
-    rclone_env['RCLONE_CONFIG_R2_ACCESS_KEY_ID'] = access_key_id
-    rclone_env['RCLONE_CONFIG_R2_SECRET_ACCESS_KEY'] = secret_access_key
-    rclone_env['RCLONE_CONFIG_R2_ENDPOINT'] = endpoint_url
-    rclone_env['RCLONE_CONFIG_R2_ACL'] = 'public-read'  # For public website hosting
-
-    logger.info("Configured rclone with credentials from Prefect block")
-
-    # Run rclone copy with the configured environment
-    process = subprocess.Popen(
-        [
-            "rclone", "sync",
-            "build/",
-            f"r2:{bucket_name}",
-            "-v",
-            "--progress",
-            "--stats", "10s",
-            "--checksum"
-        ],
-        cwd=evidence_dir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-        env=rclone_env
+    _write_build_index(bucket_name, endpoint_url, build_index)
+
+    logger.info("Deployment to R2 completed successfully!")
+    return "deployed to R2"
+
+def _upload_with_boto3(s3_client, build_dir: Path, bucket_name: str, logger,
+                       delete_stale: bool = True) -> tuple[int, int, int]:
+    """
+    Mirror build_dir into the bucket with boto3.
+
+    Returns:
+        Tuple of (files uploaded, files unchanged, stale keys deleted)
+    """
+    # One paginated listing of the destination: key -> (ETag, size)
+    remote = {}
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name):
+        for obj in page.get('Contents', []):
+            remote[obj['Key']] = (obj['ETag'].strip('"'), obj['Size'])
+
+    local = {}
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            if name != ".DS_Store":
+                path = Path(root) / name
+                local[path.relative_to(build_dir).as_posix()] = path
+
+    transfer_config = TransferConfig(
+        multipart_threshold=_MULTIPART_THRESHOLD,
+        multipart_chunksize=_MULTIPART_THRESHOLD,
+        max_concurrency=4
     )
 
-    # Stream output
-    output_lines = []
-    for line in process.stdout:
-        line = line.rstrip()
-        logger.info(line)
-        output_lines.append(line)
+    def upload(key: str, path: Path) -> bool:
+        size = path.stat().st_size
+        extra_args = {
+            'ContentType': mimetypes.guess_type(path.name)[0] or 'application/octet-stream',
+        }
+        remote_etag, remote_size = remote.get(key, (None, None))
 
-    process.wait()
+        if size < _MULTIPART_THRESHOLD:
+            body = path.read_bytes()
+            if remote_etag == hashlib.md5(body).hexdigest():
+                return False
+            s3_client.put_object(Bucket=bucket_name, Key=key, Body=body, **extra_args)
+        else:
+            # Multipart ETags are not a plain MD5, so compare sizes instead
+            if remote_etag and '-' in remote_etag and remote_size == size:
+                return False
+            s3_client.upload_file(str(path), bucket_name, key, ExtraArgs=extra_args, Config=transfer_config)
+        return True
+
+    with ThreadPoolExecutor(max_workers=_UPLOAD_WORKERS) as executor:
+        results = list(executor.map(upload, local.keys(), local.values()))
+    uploaded = sum(results)
+
+    deleted = 0
+    if delete_stale:
+        stale = [key for key in remote if key not in local]
+        for i in range(0, len(stale), _DELETE_BATCH_SIZE):
+            deleted += _delete_batch(s3_client, bucket_name, stale[i:i + _DELETE_BATCH_SIZE], logger)
+
+    return uploaded, len(results) - uploaded, deleted
+
+def _read_cleanup_watermarks() -> dict:
+    """Return the stored cleanup watermarks, or an empty dict"""
+    try:
+        return json.loads(_read_state_file(CLEANUP_WATERMARK_FILE) or "{}")
+    except ValueError:
+        return {}
 
-    if process.returncode != 0:
-        error_msg = f"rclone copy failed with return code {process.returncode}"
-        logger.error(error_msg)
-        raise subprocess.CalledProcessError(
-            process.returncode,
-            ["rclone", "copy"],
-            output="\n".join(output_lines)
+def _write_cleanup_watermarks(watermarks: dict) -> None:
+    """Atomically store the cleanup watermarks"""
+    _write_state_file(CLEANUP_WATERMARK_FILE, json.dumps(watermarks))
+
+def _delete_batch(s3_client, bucket_name: str, keys: list, logger) -> int:
+    """
+    Delete up to 1000 keys with a single delete_objects request.
+
+    Returns:
+        Number of keys deleted
+    """
+    logger.info(f"Deleting batch of {len(keys)} old file(s)...")
+    try:
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
         )
+    except Exception as e:
+        logger.error(f"Failed to delete batch of {len(keys)} file(s): {str(e)}")
+        return 0
 
-    logger.info("Deployment to R2 completed successfully!")
-    return "deployed to R2"
+    # In quiet mode only failed keys are reported back
+    errors = response.get('Errors', [])
+    for error in errors:
+        logger.error(f"Failed to delete {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+    return len(keys) - len(errors)
 
 @task(name="Cleanup old bucket files", retries=1)
 def cleanup_old_files(aws_credentials_block: str,
@@ -526,6 +1267,10 @@ def cleanup_old_files(aws_credentials_block: str,
     Clean up parquet files older than retention_days from MinIO bucket.
     Only files matching the prefix pattern will be considered for deletion.
 
+    After each complete cleanup the LastModified of the oldest remaining
+    object is stored as a watermark; while it is still inside the retention
+    window nothing can have expired and the bucket listing is skipped.
+
     Args:
         aws_credentials_block: Name of the Prefect AwsCredentials block to use
         bucket_name: Name of the S3/MinIO bucket (default: "ipfix")
@@ -541,76 +1286,94 @@ def cleanup_old_files(aws_credentials_block: str,
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=retention_days)
     logger.info(f"Cleaning up files older than {cutoff_date.isoformat()} ({retention_days} days)")
 
-    # Load credentials from Prefect block
-    logger.info(f"Loading credentials from block: {aws_credentials_block}")
-    aws_credentials = AwsCredentials.load(aws_credentials_block)
-
-    # Get the endpoint URL from the credentials block
-    # aws_client_parameters is a Pydantic model, convert to dict
-    endpoint_url = None
-    if aws_credentials.aws_client_parameters:
-        client_params = aws_credentials.aws_client_parameters.model_dump()
-        endpoint_url = client_params.get("endpoint_url")
-    logger.info(f"Block endpoint: {endpoint_url}")
-    logger.info(f"Block region: {aws_credentials.region_name}")
-
-    # Initialize S3 client with credentials from block
-    # We need to pass the endpoint_url explicitly to the client
-    boto3_session = aws_credentials.get_boto3_session()
-    s3_client = boto3_session.client(
-        's3',
-        endpoint_url=endpoint_url
-    )
+    watermark_key = f"{bucket_name}/{prefix}"
+    watermarks = _read_cleanup_watermarks()
+    watermark = watermarks.get(watermark_key)
+    if watermark and datetime.fromisoformat(watermark) >= cutoff_date:
+        logger.info(f"Oldest remaining file is from {watermark}, nothing has expired yet; skipping listing")
+        return {
+            "files_checked": 0,
+            "files_deleted": 0,
+            "files_failed": 0,
+            "bytes_freed": 0,
+            "retention_days": retention_days
+        }
+
+    # S3 client for the block, shared across tasks and retries in this process
+    s3_client = _get_s3_client(aws_credentials_block)
 
     # Log what boto3 is actually using
+    logger.info(f"Loaded credentials from block: {aws_credentials_block}")
     logger.info(f"Boto3 client endpoint: {s3_client.meta.endpoint_url}")
     logger.info(f"Boto3 client region: {s3_client.meta.region_name}")
 
     try:
-        # List all objects in bucket with the specified prefix
+        # List all objects in bucket with the specified prefix, page by page.
+        # Expired keys are deleted in batches on a thread pool while the
+        # listing continues, so LIST and DELETE round-trips overlap.
         logger.info(f"Listing objects in bucket '{bucket_name}' with prefix '{prefix}'...")
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix=prefix,
+            PaginationConfig={'PageSize': _DELETE_BATCH_SIZE}
+        )
 
-        if 'Contents' not in response:
-            logger.info(f"No files found with prefix '{prefix}' in bucket '{bucket_name}'")
-            return {
-                "files_checked": 0,
-                "files_deleted": 0,
-                "bytes_freed": 0,
-                "retention_days": retention_days
-            }
-
-        files_to_delete = []
+        files_checked = 0
+        files_marked = 0
         total_size = 0
+        oldest_kept = None
+        pending = []
+        delete_futures = []
+        with ThreadPoolExecutor(max_workers=_DELETE_WORKERS) as executor:
+            for page in pages:
+                contents = page.get('Contents', [])
+                files_checked += len(contents)
+
+                # Select files past the cutoff by modification date
+                expired = [obj for obj in contents if obj['LastModified'] < cutoff_date]
+                pending.extend(obj['Key'] for obj in expired)
+                files_marked += len(expired)
+                total_size += sum(obj['Size'] for obj in expired)
+
+                if len(expired) < len(contents):
+                    page_oldest = min(obj['LastModified'] for obj in contents if obj['LastModified'] >= cutoff_date)
+                    oldest_kept = min(oldest_kept or page_oldest, page_oldest)
+
+                if expired and logger.isEnabledFor(logging.DEBUG):
+                    for obj in expired:
+                        logger.debug(f"Marking for deletion: {obj['Key']} (modified: {obj['LastModified'].isoformat()}, size: {obj['Size']} bytes)")
+
+                while len(pending) >= _DELETE_BATCH_SIZE:
+                    delete_futures.append(executor.submit(
+                        _delete_batch, s3_client, bucket_name, pending[:_DELETE_BATCH_SIZE], logger
+                    ))
+                    pending = pending[_DELETE_BATCH_SIZE:]
+
+            if pending:
+                delete_futures.append(executor.submit(_delete_batch, s3_client, bucket_name, pending, logger))
+
+        deleted_count = sum(future.result() for future in delete_futures)
+
+        logger.info(f"Marked {files_marked} of {files_checked} file(s) for deletion ({total_size / (1024**2):.2f} MB)")
+
+        if files_checked == 0:
+            logger.info(f"No files found with prefix '{prefix}' in bucket '{bucket_name}'")
+        elif files_marked == 0:
+            logger.info(f"No files older than {retention_days} days found. Nothing to delete.")
 
-        # Check each file's modification date
-        for obj in response['Contents']:
-            file_key = obj['Key']
-            last_modified = obj['LastModified']
-            file_size = obj['Size']
-
-            if last_modified < cutoff_date:
-                files_to_delete.append(file_key)
-                total_size += file_size
-                logger.info(f"Marking for deletion: {file_key} (modified: {last_modified.isoformat()}, size: {file_size} bytes)")
-
-        # Delete old files
-        deleted_count = 0
-        if files_to_delete:
-            logger.info(f"Deleting {len(files_to_delete)} old file(s)...")
-            for file_key in files_to_delete:
-                try:
-                    s3_client.delete_object(Bucket=bucket_name, Key=file_key)
-                    logger.info(f"Deleted: {file_key}")
-                    deleted_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to delete {file_key}: {str(e)}")
+        # Only trust the watermark if every expired file is really gone.
+        # With nothing left, anything exported from now on is newer than now.
+        if deleted_count == files_marked:
+            watermarks[watermark_key] = (oldest_kept or datetime.now(timezone.utc)).isoformat()
         else:
-            logger.info(f"No files older than {retention_days} days found. Nothing to delete.")
+            watermarks.pop(watermark_key, None)
+        _write_cleanup_watermarks(watermarks)
 
         result = {
-            "files_checked": len(response['Contents']),
+            "files_checked": files_checked,
             "files_deleted": deleted_count,
+            "files_failed": files_marked - deleted_count,
             "bytes_freed": total_size,
             "retention_days": retention_days
         }
@@ -622,10 +1385,75 @@ def cleanup_old_files(aws_credentials_block: str,
         logger.error(f"Error during bucket cleanup: {str(e)}")
         raise
 
-@flow(name="IPFIX Analytics", log_prints=True)
-def ipfix_pipeline(retention_days: int = 5,
-                   minio_credentials_block: str = "minio-ipfix-credentials",
-                   r2_credentials_block: str = "r2-ipfix-analytics-credentials"):
+@task(name="Ensure bucket lifecycle policy", retries=1)
+def ensure_lifecycle_policy(aws_credentials_block: str,
+                            bucket_name: str = "ipfix",
+                            prefix: str = "ipfix_",
+                            retention_days: int = 5) -> dict:
+    """
+    Make sure the bucket expires objects under prefix after retention_days,
+    so old parquet files are removed server-side instead of by a client scan.
+    The lifecycle configuration is only written when the rule differs;
+    rules for other prefixes are left untouched.
+
+    Args:
+        aws_credentials_block: Name of the Prefect AwsCredentials block to use
+        bucket_name: Name of the S3/MinIO bucket (default: "ipfix")
+        prefix: Object prefix the rule applies to (default: "ipfix_")
+        retention_days: Number of days to retain files (default: 5)
+
+    Returns:
+        Dictionary with the rule and whether it was updated
+    """
+    logger = get_run_logger()
+    s3_client = _get_s3_client(aws_credentials_block)
+
+    rule_id = f"expire-{prefix}"
+    rule = {
+        'ID': rule_id,
+        'Filter': {'Prefix': prefix},
+        'Status': 'Enabled',
+        'Expiration': {'Days': retention_days}
+    }
+
+    try:
+        rules = s3_client.get_bucket_lifecycle_configuration(Bucket=bucket_name)['Rules']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchLifecycleConfiguration':
+            raise
+        rules = []
+
+    current = next((r for r in rules if r.get('ID') == rule_id), None)
+    if (current
+            and current.get('Filter', {}).get('Prefix', current.get('Prefix')) == prefix
+            and current.get('Status') == 'Enabled'
+            and current.get('Expiration', {}).get('Days') == retention_days):
+        logger.info(f"Lifecycle rule '{rule_id}' on '{bucket_name}' is up to date")
+        updated = False
+    else:
+        other_rules = [r for r in rules if r.get('ID') != rule_id]
+        s3_client.put_bucket_lifecycle_configuration(
+            Bucket=bucket_name,
+            LifecycleConfiguration={'Rules': other_rules + [rule]}
+        )
+        logger.info(f"Set lifecycle rule '{rule_id}' on '{bucket_name}': "
+                    f"expire '{prefix}*' after {retention_days} days")
+        updated = True
+
+    return {
+        "bucket": bucket_name,
+        "prefix": prefix,
+        "retention_days": retention_days,
+        "updated": updated
+    }
+
+@flow(name="IPFIX Analytics", log_prints=True, task_runner=ThreadPoolTaskRunner(max_workers=4))
+async def ipfix_pipeline(retention_days: int = 5,
+                         minio_credentials_block: str = "minio-ipfix-credentials",
+                         r2_credentials_block: str = "r2-ipfix-analytics-credentials",
+                         dbt_changed_only: bool = False,
+                         force: bool = False,
+                         legacy_scan: bool = False):
     """
     Main pipeline that:
     0. Validates environment (tools, credentials, directories)
@@ -635,17 +1463,32 @@ def ipfix_pipeline(retention_days: int = 5,
     4. Refreshes Evidence sources (runs queries against updated DuckDB)
     5. Builds Evidence static site
     6. Deploys build to Cloudflare R2
-    7. Cleans up old parquet files from MinIO bucket (only if all previous steps succeed)
+    7. Ensures a MinIO lifecycle rule expires old parquet files server-side
+       (or, with legacy_scan, deletes them with a client-side scan once dbt build has succeeded)
+
+    Steps are submitted as futures and only wait on their real dependencies:
+    step 1 starts before step 0 and overlaps it and step 2, and step 7
+    runs alongside steps 4-6.
+    Steps 4-6 are skipped when the dbt output and Evidence inputs hash the same
+    as at the last successful deploy.
 
     Args:
         retention_days: Number of days to retain parquet files in MinIO bucket (default: 5)
         minio_credentials_block: Name of the Prefect AwsCredentials block for MinIO access (default: "minio-ipfix-credentials")
         r2_credentials_block: Name of the Prefect AwsCredentials block for R2 access (default: "r2-ipfix-analytics-credentials")
+        dbt_changed_only: Only rebuild dbt models changed since the last run (default: False)
+        force: Rebuild and deploy the Evidence site even if the content is unchanged (default: False)
+        legacy_scan: Delete old files with a client-side bucket scan instead of a lifecycle rule (default: False)
     """
 
     print("Starting IPFIX Analytics Pipeline...")
     print(f"Working directory: {os.getcwd()}")
 
+    # Step 1: Initialize Evidence dependencies (only needed by step 4);
+    # npm runs in its own process while the environment is validated
+    print("\nStep 1: Initializing Evidence...")
+    init_future = init_evidence.submit()
+
     # Step 0: Validate environment
     print("\nStep 0: Validating environment...")
     validation_result = validate_environment(
@@ -654,44 +1497,82 @@ def ipfix_pipeline(retention_days: int = 5,
     )
     print(f"✓ Environment validation passed")
 
-    # Step 1: Initialize Evidence dependencies
-    print("\nStep 1: Initializing Evidence...")
-    init_status = init_evidence()
-    print(f"Evidence initialization: {init_status}")
-
     # Step 2: Setup DuckDB secrets for S3/MinIO access
     print("\nStep 2: Setting up DuckDB secrets...")
-    secrets_result = setup_duckdb_secrets(minio_credentials_block=minio_credentials_block)
-    print(f"✓ DuckDB secret configured for {secrets_result['endpoint']}")
-    print(f"✓ Test query found {secrets_result['test_record_count']:,} records")
+    secrets_future = setup_duckdb_secrets.submit(minio_credentials_block=minio_credentials_block)
 
     # Step 3: Run dbt build
     print("\nStep 3: Running dbt build...")
-    dbt_result = run_dbt_build()
+    dbt_future = run_dbt_build.submit(changed_only=dbt_changed_only, wait_for=[secrets_future])
+
+    # Step 7: Expire old files from MinIO bucket, independent of the Evidence/R2 chain
+    if legacy_scan:
+        print(f"\nStep 7: Cleaning up files older than {retention_days} days from MinIO bucket...")
+        cleanup_future = cleanup_old_files.submit(
+            aws_credentials_block=minio_credentials_block,
+            retention_days=retention_days,
+            wait_for=[dbt_future]
+        )
+    else:
+        print(f"\nStep 7: Ensuring MinIO lifecycle rule expires files after {retention_days} days...")
+        cleanup_future = ensure_lifecycle_policy.submit(
+            aws_credentials_block=minio_credentials_block,
+            retention_days=retention_days
+        )
+
+    # Skip the Evidence/R2 chain when nothing it is built from has changed
+    content_digest = compute_content_digest.submit(wait_for=[dbt_future]).result()
+    content_changed = force or content_digest != _read_state_file(LAST_DIGEST_FILE)
+
+    if content_changed:
+        # Step 4: Refresh Evidence sources, warming the DuckDB file while Node starts up
+        print("\nStep 4: Refreshing Evidence sources...")
+        prewarm_future = prewarm_duckdb.submit(wait_for=[dbt_future])
+        sources_future = refresh_evidence_sources.submit(wait_for=[dbt_future, init_future])
+
+        # Step 5: Build Evidence site
+        print("\nStep 5: Building Evidence site...")
+        # Also waits for the prewarm, so it is finished and its logs are kept before the flow returns
+        build_future = build_evidence.submit(force=force, wait_for=[sources_future, prewarm_future])
+
+        # Step 6: Deploy to R2
+        print("\nStep 6: Deploying to R2...")
+        deploy_future = deploy_to_r2.submit(aws_credentials_block=r2_credentials_block, wait_for=[build_future])
+    else:
+        print("\nSteps 4-6: Content unchanged since last deploy, skipping Evidence build and R2 deploy")
+
+    # Collect results
+    init_status = init_future.result()
+    print(f"Evidence initialization: {init_status}")
+
+    secrets_result = secrets_future.result()
+    print(f"✓ DuckDB secret configured for {secrets_result['endpoint']}")
+    if secrets_result['test_file_count'] is not None:
+        print(f"✓ Test query found {secrets_result['test_file_count']:,} files")
+    if secrets_result['test_record_count'] is not None:
+        print(f"✓ Test query found {secrets_result['test_record_count']:,} records")
+
+    dbt_result = dbt_future.result()
     print(f"dbt build completed with return code: {dbt_result['returncode']}")
 
-    # Step 4: Refresh Evidence sources
-    print("\nStep 4: Refreshing Evidence sources...")
-    sources_status = refresh_evidence_sources()
-    print(f"Evidence sources: {sources_status}")
+    if content_changed:
+        sources_status = sources_future.result()
+        build_status = build_future.result()
+        deploy_status = deploy_future.result()
+        _write_state_file(LAST_DIGEST_FILE, content_digest)
+    else:
+        sources_status = build_status = deploy_status = "skipped"
 
-    # Step 5: Build Evidence site
-    print("\nStep 5: Building Evidence site...")
-    build_status = build_evidence()
+    print(f"Evidence sources: {sources_status}")
     print(f"Evidence build: {build_status}")
-
-    # Step 6: Deploy to R2
-    print("\nStep 6: Deploying to R2...")
-    deploy_status = deploy_to_r2(aws_credentials_block=r2_credentials_block)
     print(f"R2 deployment: {deploy_status}")
 
-    # Step 7: Cleanup old files from MinIO bucket
-    print(f"\nStep 7: Cleaning up files older than {retention_days} days from MinIO bucket...")
-    cleanup_result = cleanup_old_files(
-        aws_credentials_block=minio_credentials_block,
-        retention_days=retention_days
-    )
-    print(f"Cleanup completed: {cleanup_result['files_deleted']} files deleted, {cleanup_result['bytes_freed'] / (1024**2):.2f} MB freed")
+    cleanup_result = cleanup_future.result()
+    if legacy_scan:
+        print(f"Cleanup completed: {cleanup_result['files_deleted']} files deleted, {cleanup_result['bytes_freed'] / (1024**2):.2f} MB freed")
+    else:
+        print(f"Lifecycle rule {'updated' if cleanup_result['updated'] else 'unchanged'}: "
+              f"'{cleanup_result['prefix']}' expires after {cleanup_result['retention_days']} days")
 
     print("\n" + "="*60)
     print("Pipeline completed successfully!")
@@ -708,6 +1589,5 @@ def ipfix_pipeline(retention_days: int = 5,
         "cleanup": cleanup_result
     }
 
-
 if __name__ == "__main__":
-    ipfix_pipeline()
+    asyncio.run(ipfix_pipeline())
@@ -16,10 +16,11 @@ SELECT 'Step 1 complete: Marked rows for export' AS status;
 SELECT concat('Rows marked: ', toString(count())) FROM playground.ipfix_raw_data WHERE exported = 1;
 
 -- Step 2: Export what is marked
+-- S3 location and credentials are bound server-side as query parameters
 INSERT INTO FUNCTION s3(
-    concat('https://{{ s3_endpoint }}/{{ s3_bucket }}/ipfix_decoded_', formatDateTime(now(), '%Y%m%d_%H%i%S'), '.parquet'),
-    '{{ s3_access_key }}',
-    '{{ s3_secret_key }}',
+    concat('https://', {s3_endpoint:String}, '/', {s3_bucket:String}, '/ipfix_decoded_', formatDateTime(now(), '%Y%m%d_%H%i%S'), '.parquet'),
+    {s3_access_key:String},
+    {s3_secret_key:String},
     'Parquet'
 )
 SELECT
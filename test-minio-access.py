@@ -26,10 +26,7 @@ except Exception as e:
     exit(1)
 
 # Extract endpoint configuration
-endpoint_url = None
-if aws_credentials.aws_client_parameters:
-    client_params = aws_credentials.aws_client_parameters.model_dump()
-    endpoint_url = client_params.get("endpoint_url")
+endpoint_url = getattr(aws_credentials.aws_client_parameters, "endpoint_url", None)
 
 print(f"\n[2/4] Configuration from block:")
 print(f"  - Endpoint: {endpoint_url}")